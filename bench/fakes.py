@@ -0,0 +1,291 @@
+"""
+Local stand-ins for the osu! API and the calculator (tools) API, for benchmarks and load tests.
+
+    uvicorn bench.fakes:osu_api_app --port 9001
+    uvicorn bench.fakes:calculator_app --port 9002
+
+Responses are deterministic and derived from the request (user name, ids, ...). Every request
+waits FAKE_OSU_LATENCY_MS / FAKE_CALCULATOR_LATENCY_MS milliseconds, give or take
+FAKE_LATENCY_JITTER (a fraction of the latency), to mimic the real upstream round-trip.
+With FAKE_OSU_RATE_LIMIT (requests per minute), the osu! API stand-in answers 429 beyond it.
+"""
+import asyncio
+import os
+import random
+import time
+import zlib
+from collections import deque
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+FAKE_OSU_LATENCY_MS = float(os.getenv("FAKE_OSU_LATENCY_MS", "150"))
+FAKE_CALCULATOR_LATENCY_MS = float(os.getenv("FAKE_CALCULATOR_LATENCY_MS", "80"))
+FAKE_LATENCY_JITTER = float(os.getenv("FAKE_LATENCY_JITTER", "0.2"))
+FAKE_OSU_RATE_LIMIT = int(os.getenv("FAKE_OSU_RATE_LIMIT", "0"))
+
+MODES = ["osu", "taiko", "fruits", "mania"]
+
+
+async def _sleep(latency_ms: float):
+    if latency_ms > 0:
+        jitter = random.uniform(-FAKE_LATENCY_JITTER, FAKE_LATENCY_JITTER)
+        await asyncio.sleep(latency_ms * (1 + jitter) / 1000)
+
+
+def _seed(value) -> int:
+    return zlib.crc32(str(value).lower().encode())
+
+
+# osu! API
+# --------
+
+osu_api_app = FastAPI()
+# Request times of the last minute, for FAKE_OSU_RATE_LIMIT
+_recent_requests = deque()
+# Usernames by user id, filled by username lookups so that id lookups answer the same name
+_usernames: dict[int, str] = {}
+
+
+@osu_api_app.middleware("http")
+async def osu_api_latency(request: Request, call_next):
+    if FAKE_OSU_RATE_LIMIT:
+        now = time.monotonic()
+        while _recent_requests and _recent_requests[0] < now - 60:
+            _recent_requests.popleft()
+        if len(_recent_requests) >= FAKE_OSU_RATE_LIMIT:
+            retry_after = int(_recent_requests[0] + 60 - now) + 1
+            return JSONResponse({"error": "Too Many Attempts."}, status_code=429, headers={"Retry-After": str(retry_after)})
+        _recent_requests.append(now)
+    await _sleep(FAKE_OSU_LATENCY_MS)
+    return await call_next(request)
+
+
+def _user_compact(user_id: int, username: str) -> dict:
+    return {
+        "id": user_id,
+        "username": username,
+        "avatar_url": f"https://a.ppy.sh/{user_id}",
+        "country_code": "FR",
+        "default_group": "default",
+        "is_active": True,
+        "is_bot": False,
+        "is_deleted": False,
+        "is_online": False,
+        "is_supporter": False,
+        "last_visit": None,
+        "pm_friends_only": False,
+        "profile_colour": None,
+    }
+
+
+def _beatmapset(beatmapset_id: int) -> dict:
+    return {
+        "id": beatmapset_id,
+        "artist": f"Artist {beatmapset_id % 97}",
+        "artist_unicode": f"Artist {beatmapset_id % 97}",
+        "title": f"Song {beatmapset_id}",
+        "title_unicode": f"Song {beatmapset_id}",
+        "creator": f"Mapper {beatmapset_id % 31}",
+        "covers": {key: f"https://assets.ppy.sh/beatmaps/{beatmapset_id}/covers/{key}.jpg"
+                   for key in ("cover", "cover@2x", "card", "card@2x", "list", "list@2x", "slimcover", "slimcover@2x")},
+        "favourite_count": 0,
+        "nsfw": False,
+        "offset": 0,
+        "play_count": 1000,
+        "preview_url": "",
+        "source": "",
+        "spotlight": False,
+        "status": "ranked",
+        "user_id": 2,
+        "video": False,
+        "ranked_date": "2020-01-01T00:00:00+00:00",
+        "last_updated": "2020-01-01T00:00:00+00:00",
+    }
+
+
+def _beatmap(beatmap_id: int, with_beatmapset: bool = True) -> dict:
+    rng = random.Random(beatmap_id)
+    beatmapset_id = beatmap_id // 10
+    beatmap = {
+        "id": beatmap_id,
+        "beatmapset_id": beatmapset_id,
+        "difficulty_rating": round(rng.uniform(2, 8), 2),
+        "mode": "osu",
+        "mode_int": 0,
+        "status": "ranked",
+        "ranked": 1,
+        "total_length": 180,
+        "hit_length": 170,
+        "user_id": 2,
+        "version": f"Difficulty {beatmap_id % 10}",
+        "accuracy": 9.0,
+        "ar": 9.5,
+        "cs": 4.0,
+        "drain": 5.0,
+        "bpm": 180.0,
+        "convert": False,
+        "count_circles": 600,
+        "count_sliders": 300,
+        "count_spinners": 2,
+        "is_scoreable": True,
+        "last_updated": "2020-01-01T00:00:00+00:00",
+        "passcount": 5000,
+        "playcount": 50000,
+        "max_combo": 1200,
+        "url": f"https://osu.ppy.sh/beatmaps/{beatmap_id}",
+    }
+    if with_beatmapset:
+        beatmap["beatmapset"] = _beatmapset(beatmapset_id)
+    return beatmap
+
+
+@osu_api_app.post("/oauth/token")
+async def token():
+    return {"token_type": "Bearer", "expires_in": 86400, "access_token": "fake-access-token"}
+
+
+@osu_api_app.get("/api/v2/users/{user}/{mode}")
+@osu_api_app.get("/api/v2/users/{user}/")
+async def user(user: str, mode: Optional[str] = None, key: Optional[str] = None):
+    if key == "id":
+        user_id = int(user)
+        username = _usernames.get(user_id, f"user{user_id}")
+    else:
+        user_id = _seed(user) % 10_000_000
+        username = _usernames.setdefault(user_id, user)
+    rng = random.Random(user_id)
+    pp = round(rng.uniform(1000, 20000), 2)
+    return {
+        **_user_compact(user_id, username),
+        "cover_url": f"https://assets.ppy.sh/user-profile-covers/{user_id}.jpg",
+        "playmode": mode or "osu",
+        "support_level": 0,
+        "country": {"code": "FR", "name": "France"},
+        "user_achievements": [{"achieved_at": "2020-01-01T00:00:00+00:00", "achievement_id": i} for i in range(50)],
+        "rank_history": {"mode": mode or "osu", "data": [rng.randint(1000, 100000) for _ in range(90)]},
+        "statistics": {
+            "count_100": 0, "count_300": 0, "count_50": 0, "count_miss": 0,
+            "grade_counts": {"a": 100, "s": 50, "sh": 10, "ss": 5, "ssh": 1},
+            "hit_accuracy": round(rng.uniform(95, 99.5), 2),
+            "is_ranked": True,
+            "level": {"current": 100, "progress": 50},
+            "maximum_combo": 3000,
+            "play_count": 50000,
+            "play_time": 3_000_000,
+            "pp": pp,
+            "global_rank": max(1, int(1_000_000 / (1 + pp / 100))),
+            "country_rank": max(1, int(50_000 / (1 + pp / 100))),
+            "ranked_score": 10 ** 10,
+            "replays_watched_by_others": 1000,
+            "total_hits": 10 ** 7,
+            "total_score": 10 ** 11,
+        },
+    }
+
+
+@osu_api_app.get("/api/v2/users/{user_id}/scores/{score_type}")
+async def user_scores(user_id: int, score_type: str, mode: Optional[str] = None, limit: int = 100):
+    rng = random.Random(user_id)
+    pps = sorted((rng.uniform(100, 800) for _ in range(limit)), reverse=True)
+    scores = []
+    for i, pp in enumerate(pps):
+        beatmap_id = rng.randint(10_000, 5_000_000)
+        scores.append({
+            "id": user_id * 1000 + i,
+            "user_id": user_id,
+            "accuracy": rng.uniform(0.9, 1),
+            "ended_at": "2024-01-01T00:00:00+00:00",
+            "max_combo": rng.randint(100, 1200),
+            "mods": [{"acronym": acronym} for acronym in rng.choice([[], ["HD"], ["HD", "DT"], ["HR"]])],
+            "passed": True,
+            "pp": pp,
+            "rank": rng.choice(["X", "S", "A"]),
+            "ruleset_id": MODES.index(mode or "osu"),
+            "statistics": {"great": 900, "ok": rng.randint(0, 20), "meh": rng.randint(0, 5), "miss": rng.randint(0, 3)},
+            "total_score": rng.randint(10 ** 5, 10 ** 6),
+            "type": "solo_score",
+            "weight": {"percentage": 100 * 0.95 ** i, "pp": pp * 0.95 ** i},
+            "beatmap": _beatmap(beatmap_id, with_beatmapset=False),
+            "beatmapset": _beatmapset(beatmap_id // 10),
+        })
+    return scores
+
+
+@osu_api_app.get("/api/v2/search")
+async def search(query: str = "", mode: Optional[str] = None, page: Optional[int] = None):
+    usernames = [f"{query}{i}" if i else query for i in range(_seed(query) % 8)]
+    # Same ids as the username lookups, search results also fill the app's user id cache
+    users = [_user_compact(_seed(name) % 10_000_000, _usernames.setdefault(_seed(name) % 10_000_000, name))
+             for name in usernames]
+    return {"user": {"data": users, "total": len(users)}, "wiki_page": {"data": [], "total": 0}}
+
+
+@osu_api_app.get("/api/v2/beatmapsets/search")
+async def search_beatmapsets(q: str = ""):
+    seed = _seed(q)
+    beatmapsets = []
+    for i in range(seed % 50):
+        beatmapset = _beatmapset(seed % 1_000_000 + i)
+        beatmapset["beatmaps"] = [_beatmap(beatmapset["id"] * 10 + j, with_beatmapset=False) for j in range(4)]
+        beatmapsets.append(beatmapset)
+    return {"beatmapsets": beatmapsets, "cursor": None, "cursor_string": None, "total": len(beatmapsets)}
+
+
+@osu_api_app.get("/api/v2/beatmaps/lookup")
+async def beatmap(id: int):
+    return _beatmap(id)
+
+
+@osu_api_app.post("/api/v2/beatmaps/{beatmap_id}/attributes")
+async def beatmap_attributes(beatmap_id: int):
+    rng = random.Random(beatmap_id)
+    return {"attributes": {
+        "max_combo": 1200,
+        "star_rating": round(rng.uniform(2, 8), 2),
+        "aim_difficulty": rng.uniform(1.5, 4),
+        "speed_difficulty": rng.uniform(1.5, 3.5),
+        "speed_note_count": 400.0,
+        "flashlight_difficulty": rng.uniform(1, 3),
+        "slider_factor": 0.98,
+        "approach_rate": 9.5,
+        "overall_difficulty": 9.0,
+    }}
+
+
+# Calculator (tools) API
+# ----------------------
+
+calculator_app = FastAPI()
+
+
+@calculator_app.middleware("http")
+async def calculator_latency(request: Request, call_next):
+    await _sleep(FAKE_CALCULATOR_LATENCY_MS)
+    return await call_next(request)
+
+
+@calculator_app.post("/simulate/new_score/{mode}")
+async def simulate_new_score(mode: str, request: Request):
+    params = await request.json()
+    beatmap_id = params.get("beatmapId") or (_seed(params.get("scoreId")) % 5_000_000)
+    rng = random.Random(_seed(sorted(params.items())))
+    accuracy = params.get("accPercent") or round(rng.uniform(90, 100), 2)
+    return {
+        "beatmap_id": beatmap_id,
+        "accuracy": accuracy,
+        "pp": round(rng.uniform(100, 800) * accuracy / 100, 3),
+        "combo": params.get("combo") or 1200,
+        "grade": "S" if accuracy > 93 else "A",
+    }
+
+
+@calculator_app.get("/convert/to-rank")
+async def convert_to_rank(pp: float, mode: int = 0):
+    return {"rank": max(1, int(2_000_000 / (1 + (pp / 1000) ** 3)))}
+
+
+@calculator_app.get("/convert/to-pp")
+async def convert_to_pp(rank: int, mode: int = 0):
+    return {"pp": 1000 * max(0.0, 2_000_000 / max(rank, 1) - 1) ** (1 / 3)}
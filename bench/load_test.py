@@ -0,0 +1,152 @@
+"""
+Load test for the backend: runs one scenario per router under concurrency and reports
+throughput, latency percentiles and errors.
+
+    python -m bench.load_test --base-url http://localhost:8000 --concurrency 32 --requests 500
+
+Point the backend at the local fakes (see bench/fakes.py and the README) to measure the
+service itself rather than the osu! API and the calculator.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+
+MODES = ["osu", "taiko", "catch", "mania"]
+
+
+def _username(i: int, users: int) -> str:
+    return f"player{i % users}"
+
+
+def _percentile(sorted_values: list[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(percentile / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# Each scenario builds the request of iteration i: (method, url, json body or None)
+
+def user_info(i, args):
+    return "GET", f"/user/info/{_username(i, args.users)}/{MODES[i % len(MODES)]}", None
+
+
+def user_scores(i, args):
+    return "GET", f"/user/scores/{_username(i, args.users)}/osu", None
+
+
+def search_user(i, args):
+    name = _username(i, args.users)
+    return "GET", f"/search/user?query={name[:3 + i % (len(name) - 2)]}", None
+
+
+def search_beatmap(i, args):
+    return "GET", f"/search/beatmap?query=song {i % args.users}&mode=0", None
+
+
+def simulate(i, args):
+    body = {"beatmapId": 100_000 + i % args.users, "mods": ["HD"], "accPercent": 95 + i % 5, "nmiss": i % 3}
+    return "POST", "/score/simulate/osu", body
+
+
+def convert(i, args):
+    if i % 2:
+        return "GET", f"/convert/to-rank?pp={1000 + i % 15000}&mode=0", None
+    return "GET", f"/convert/to-pp?rank={1 + i % 1_000_000}&mode=0", None
+
+
+def update_new(i, args):
+    profile, scores = args.fixtures
+    new_score = dict(random.Random(i).choice(scores), is_true_score=False, id=-1 - i, pp=scores[0]["pp"] * 0.9)
+    return "POST", "/update/new", {"profile": profile, "scores": scores, "new_score": new_score}
+
+
+SCENARIOS = {
+    "user_info": user_info,
+    "user_scores": user_scores,
+    "search_user": search_user,
+    "search_beatmap": search_beatmap,
+    "simulate": simulate,
+    "convert": convert,
+    "update_new": update_new,
+}
+
+
+async def load_fixtures(client: httpx.AsyncClient):
+    """
+    A real profile and its top plays, used as the body of the update scenarios
+    """
+    profile = (await client.get("/user/info/player0/osu")).raise_for_status().json()
+    scores = (await client.get("/user/scores/player0/osu")).raise_for_status().json()
+    return profile, scores
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, args) -> dict:
+    build = SCENARIOS[name]
+    latencies = []
+    errors = {}
+    counter = iter(range(args.requests))
+
+    async def worker():
+        for i in counter:
+            method, url, body = build(i, args)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, json=body)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors[status] = errors.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": _percentile(latencies, 50),
+        "p95": _percentile(latencies, 95),
+        "p99": _percentile(latencies, 99),
+        "errors": errors,
+    }
+
+
+def print_report(results: list[dict]):
+    print(f"{'scenario':<16}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  errors")
+    for r in results:
+        errors = ", ".join(f"{status}: {count}" for status, count in r["errors"].items()) or "-"
+        print(
+            f"{r['scenario']:<16}{r['requests']:>10}{r['throughput']:>10.1f}"
+            f"{r['p50'] * 1000:>10.1f}{r['p95'] * 1000:>10.1f}{r['p99'] * 1000:>10.1f}  {errors}"
+        )
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        if "update_new" in args.scenarios:
+            args.fixtures = await load_fixtures(client)
+        results = []
+        for name in args.scenarios:
+            results.append(await run_scenario(client, name, args))
+    print_report(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the PP Rank Theorizer backend")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients per scenario")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--users", type=int, default=50,
+                        help="Distinct users/beatmaps to cycle through, lower values mean more cache hits")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    asyncio.run(main(parser.parse_args()))
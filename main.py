@@ -1,28 +1,69 @@
+import math
 import os
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from dotenv import load_dotenv
+
+# Settings are read from the environment when modules are imported, so load .env first
+load_dotenv()
+
+from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
-from ossapi import Ossapi, ScoreType, GameMode
-from starlette.responses import JSONResponse
+from ossapi import ScoreType, GameMode
+from starlette.responses import JSONResponse, PlainTextResponse
 
 from routers.search_router import search_router
 from routers.user_data_router import user_data_router
 from routers.pp_calc_router import pp_calc_router
 from routers.score_simulator_router import score_simulator_router
+from routers.session_router import session_router
 from fastapi.middleware.cors import CORSMiddleware
 
 from routers.user_update_router import user_update_router
+from services import beatmap_index, calculator, metrics, osu_api, rank_index
+from services.compression import CompressionMiddleware
+
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await calculator.startup()
+    await osu_api.startup()
+    rank_index.start()
+    beatmap_index.start()
+    yield
+    await beatmap_index.stop()
+    await rank_index.stop()
+    await calculator.shutdown()
+    osu_api.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.exception_handler(RequestValidationError)
-async def validation_exception_handler(exc: RequestValidationError):
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
     errors = exc.errors()
     print("Validation errors:", errors)
     return JSONResponse(
         status_code=422,
         content={"detail": errors},
     )
+
+@app.exception_handler(osu_api.OsuApiUnavailable)
+@app.exception_handler(calculator.CalculatorUnavailable)
+async def upstream_unavailable_handler(request: Request, exc: Exception):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+# Compress large responses (brotli or gzip, whichever the client accepts)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -39,6 +80,11 @@ app.include_router(user_update_router, prefix="/update")
 app.include_router(pp_calc_router, prefix="/convert")
 app.include_router(score_simulator_router, prefix="/score")
 app.include_router(search_router, prefix="/search")
+app.include_router(session_router, prefix="/session")
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(await metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
@@ -50,11 +96,9 @@ async def say_hello(name: str):
 
 @app.get("/osu-test-test-test/{name}")
 async def osu_test(name: str):
-    api = Ossapi(int(os.getenv("OSU_CLIENT_ID")), os.getenv("OSU_CLIENT_SECRET"))
-
-    user = api.user(name)
+    user = await osu_api.user(name)
 
-    user_scores = api.user_scores(user.id, type=ScoreType.BEST, limit=5, mode=GameMode.OSU)
+    user_scores = await osu_api.user_scores(user.id, type=ScoreType.BEST, limit=5, mode=GameMode.OSU)
 
     print(user_scores)
 
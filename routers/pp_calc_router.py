@@ -1,67 +1,69 @@
+import asyncio
 import os
+import time
 
 from fastapi import APIRouter, HTTPException
 import httpx
 from typing import Optional
 
-from ossapi import Ossapi
-from dotenv import load_dotenv
+from services import calculator, rank_index
+from services.cache import SingleFlight, create_cache
 
-load_dotenv()
 pp_calc_router = APIRouter()
 
-HELPER_URL = "https://that-game-tools-api-production.up.railway.app"
-API_KEY = os.getenv("TOOLS_API_KEY")
+# Calculator conversions are reused for CONVERT_CACHE_FRESH seconds. After that, and for up
+# to CONVERT_CACHE_STALE_TTL seconds, the last known value is answered right away, marked as
+# stale, while a background call refreshes it
+CONVERT_CACHE_SIZE = int(os.getenv("CONVERT_CACHE_SIZE", "10000"))
+CONVERT_CACHE_FRESH = float(os.getenv("CONVERT_CACHE_FRESH", "300"))
+CONVERT_CACHE_STALE_TTL = float(os.getenv("CONVERT_CACHE_STALE_TTL", "86400"))
 
-api = Ossapi(int(os.getenv("OSU_CLIENT_ID")), os.getenv("OSU_CLIENT_SECRET"))
+# (path, params) -> (calculator response, time it was fetched)
+convert_cache = create_cache(maxsize=CONVERT_CACHE_SIZE, ttl=CONVERT_CACHE_STALE_TTL, name="convert")
+_inflight = SingleFlight()
+_refresh_tasks = set()
 
-@pp_calc_router.get("/to-pp")
-async def convert_rank_to_pp(rank: int, mode: Optional[int] = 0):
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{HELPER_URL}/convert/to-pp",
-                params={"rank": rank, "mode": mode},
-                headers={"x-api-key": API_KEY}
-            )
-
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Calculator API error: {response.text}"
-                )
 
-            return response.json()
+async def _fetch_conversion(path: str, params: dict, key: tuple) -> dict:
+    response = await calculator.get(path, params=params)
 
-    except httpx.RequestError as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error communicating with calculator API: {str(e)}"
-        )
-    except Exception as e:
+    if response.status_code != 200:
         raise HTTPException(
-            status_code=500,
-            detail=f"Unexpected error: {str(e)}"
+            status_code=response.status_code,
+            detail=f"Calculator API error: {response.text}"
         )
 
-@pp_calc_router.get("/to-rank")
-async def convert_pp_to_rank(pp: float, mode: Optional[int] = 0):
+    result = response.json()
+    await convert_cache.aset(key, (result, time.time()))
+    return result
+
+
+async def _refresh_conversion(path: str, params: dict, key: tuple):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{HELPER_URL}/convert/to-rank",
-                params={"pp": pp, "mode": mode},
-                headers={"x-api-key": API_KEY}
-            )
+        await _inflight.do(key, lambda: _fetch_conversion(path, params, key))
+    except calculator.CalculatorUnavailable:
+        pass
+    except Exception as e:
+        print(f"Background refresh of {path} {params} failed: {e}")
 
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Calculator API error: {response.text}"
-                )
 
-            return response.json()
+async def convert(path: str, params: dict) -> dict:
+    key = (path, tuple(sorted(params.items())))
+    entry = await convert_cache.aget(key)
+    if entry is not None:
+        result, fetched_at = entry
+        if time.time() - fetched_at < CONVERT_CACHE_FRESH:
+            return result
+        task = asyncio.create_task(_refresh_conversion(path, params, key))
+        _refresh_tasks.add(task)
+        task.add_done_callback(_refresh_tasks.discard)
+        return {**result, "stale": True}
 
+    try:
+        return await _inflight.do(key, lambda: _fetch_conversion(path, params, key))
+
+    except calculator.CalculatorUnavailable:
+        raise
     except httpx.RequestError as e:
         raise HTTPException(
             status_code=500,
@@ -71,4 +73,22 @@ async def convert_pp_to_rank(pp: float, mode: Optional[int] = 0):
         raise HTTPException(
             status_code=500,
             detail=f"Unexpected error: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@pp_calc_router.get("/to-pp")
+async def convert_rank_to_pp(rank: int, mode: Optional[int] = 0):
+    # Answer from the local pp/rank table when it covers this mode
+    pp = rank_index.rank_to_pp(rank, mode)
+    if pp is not None:
+        return {"pp": pp}
+
+    return await convert("/convert/to-pp", {"rank": rank, "mode": mode})
+
+@pp_calc_router.get("/to-rank")
+async def convert_pp_to_rank(pp: float, mode: Optional[int] = 0):
+    # Answer from the local pp/rank table when it covers this mode
+    rank = rank_index.pp_to_rank(pp, mode)
+    if rank is not None:
+        return {"rank": rank}
+
+    return await convert("/convert/to-rank", {"pp": pp, "mode": mode})
@@ -1,21 +1,22 @@
+import asyncio
 import os
 import random
 from datetime import datetime, timezone
-from typing import Optional, List, Dict, Any
+from typing import Annotated, Optional, List, Dict, Any
 from enum import Enum
 
-from dotenv import load_dotenv
 from fastapi import APIRouter, HTTPException
-from ossapi import Ossapi
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError
 import httpx
 
-load_dotenv()
+from services import calculator, osu_api, pp_formula
+from services.beatmaps import get_beatmap_metadata
+from services.cache import SingleFlight, create_cache
+from services.difficulty import get_difficulty_attributes
+from services.responses import FastJSONResponse
 
 score_simulator_router = APIRouter()
 
-api = Ossapi(int(os.getenv("OSU_CLIENT_ID")), os.getenv("OSU_CLIENT_SECRET"))
-
 # Base models
 class UserStats(BaseModel):
     accuracy: float
@@ -101,9 +102,68 @@ class ManiaScoreParams(BaseScoreParams):
     n100: Optional[int] = None
     n50: Optional[int] = None
 
-# Constants
-HELPER_URL = "https://that-game-tools-api-production.up.railway.app"
-API_KEY = os.getenv("TOOLS_API_KEY")
+SCORE_PARAMS_MODELS = {
+    GameMode.OSU: OsuScoreParams,
+    GameMode.TAIKO: TaikoScoreParams,
+    GameMode.CATCH: CatchScoreParams,
+    GameMode.MANIA: ManiaScoreParams,
+}
+
+class BatchScoreItem(BaseModel):
+    mode: GameMode
+    # Validated against the model of `mode` per item, so one bad item does not reject the batch
+    params: Dict[str, Any]
+
+class BatchScoreParams(BaseModel):
+    items: List[BatchScoreItem]
+
+SweepAccuracy = Annotated[float, Field(ge=0, le=100)]
+SweepMisses = Annotated[int, Field(ge=0)]
+
+class AccuracySweepParams(BaseModel):
+    beatmapId: int
+    mods: List[str] = []
+    accuracies: List[SweepAccuracy] = [90 + i * 0.5 for i in range(21)]
+    misses: List[SweepMisses] = [0, 1, 2, 3, 4, 5]
+    combo: Optional[int] = Field(default=None, ge=0)
+
+# Batch simulation limits
+SIMULATION_BATCH_CONCURRENCY = int(os.getenv("SIMULATION_BATCH_CONCURRENCY", "8"))
+SIMULATION_BATCH_MAX_ITEMS = int(os.getenv("SIMULATION_BATCH_MAX_ITEMS", "100"))
+# Accuracy sweep grid limit (accuracies x misses)
+ACCURACY_SWEEP_MAX_POINTS = int(os.getenv("ACCURACY_SWEEP_MAX_POINTS", "10000"))
+
+# Calculator simulations are deterministic, identical parameter sets are only sent once
+SIMULATION_CACHE_SIZE = int(os.getenv("SIMULATION_CACHE_SIZE", "20000"))
+SIMULATION_CACHE_TTL = float(os.getenv("SIMULATION_CACHE_TTL", "86400"))
+
+# (mode, canonical calculator payload) -> calculator response
+simulation_cache = create_cache(maxsize=SIMULATION_CACHE_SIZE, ttl=SIMULATION_CACHE_TTL, name="simulation")
+_inflight = SingleFlight()
+
+
+def _simulation_key(game_mode: GameMode, payload: Dict[str, Any]) -> tuple:
+    # The mods order does not change the result
+    return game_mode.value, tuple(sorted(
+        (name, tuple(sorted(value)) if name == "mods" else value)
+        for name, value in payload.items()
+    ))
+
+async def _fetch_simulation(game_mode: GameMode, payload: Dict[str, Any], key: tuple) -> Dict[str, Any]:
+    response = await calculator.post(
+        f"/simulate/new_score/{game_mode.value}",
+        json=payload,
+    )
+
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"Calculator API error: {response.text}"
+        )
+
+    result = response.json()
+    await simulation_cache.aset(key, result)
+    return result
 
 # Helper function to simulate a score
 async def simulate_score(game_mode: GameMode, params: Dict[str, Any]) -> Dict[str, Any]:
@@ -111,58 +171,47 @@ async def simulate_score(game_mode: GameMode, params: Dict[str, Any]) -> Dict[st
     Generic function to simulate a score for any game mode
     """
     try:
-        async with httpx.AsyncClient() as client:
-            if "scoreId" in params and params["scoreId"]:
-                # If scoreId is provided, just forward it to the calculator
-                response = await client.post(
-                    f"{HELPER_URL}/simulate/new_score/{game_mode.value}",
-                    json={"scoreId": params["scoreId"]},
-                    headers={"x-api-key": API_KEY}
-                )
-            else:
-                # Filter out None values
-                calculator_params = {k: v for k, v in params.items() if v is not None}
-                response = await client.post(
-                    f"{HELPER_URL}/simulate/new_score/{game_mode.value}",
-                    json=calculator_params,
-                    headers={"x-api-key": API_KEY}
-                )
-
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Calculator API error: {response.text}"
-                )
-
-            r = response.json()
-
-            # Get beatmap info
-            beatmap = api.beatmap(r["beatmap_id"])
-
-            # Construct the response
-            returned_score = {
-                "is_true_score": False,
-                "accuracy": r["accuracy"],
-                "score": 0,
-                "id": random.randint(-9999999, -1000000),
-                "beatmap_url": f'https://osu.ppy.sh/beatmaps/{r["beatmap_id"]}',
-                "title": beatmap.beatmapset().title,
-                "artist": beatmap.beatmapset().artist,
-                "version": beatmap.version,
-                "date": datetime.now(timezone.utc),
-                "mods": params.get("mods", []),
-                "pp": r["pp"],
-                "max_combo": r["combo"],
-                "grade": r["grade"],
-            }
+        if "scoreId" in params and params["scoreId"]:
+            # If scoreId is provided, just forward it to the calculator
+            calculator_params = {"scoreId": params["scoreId"]}
+        else:
+            # Filter out None values
+            calculator_params = {k: v for k, v in params.items() if v is not None}
 
-            return returned_score
+        key = _simulation_key(game_mode, calculator_params)
+        r = await simulation_cache.aget(key)
+        if r is None:
+            r = await _inflight.do(key, lambda: _fetch_simulation(game_mode, calculator_params, key))
+
+        # Get beatmap info
+        beatmap = await get_beatmap_metadata(r["beatmap_id"])
+
+        # Construct the response
+        returned_score = {
+            "is_true_score": False,
+            "accuracy": r["accuracy"],
+            "score": 0,
+            "id": random.randint(-9999999, -1000000),
+            "beatmap_url": f'https://osu.ppy.sh/beatmaps/{r["beatmap_id"]}',
+            "title": beatmap["title"],
+            "artist": beatmap["artist"],
+            "version": beatmap["version"],
+            "date": datetime.now(timezone.utc),
+            "mods": params.get("mods", []),
+            "pp": r["pp"],
+            "max_combo": r["combo"],
+            "grade": r["grade"],
+        }
+
+        return returned_score
 
     except httpx.RequestError as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error communicating with calculator API: {str(e)}"
         )
+    except (osu_api.OsuApiUnavailable, calculator.CalculatorUnavailable):
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -200,4 +249,85 @@ async def simulate_mania_score(params: ManiaScoreParams):
     return await simulate_score(
         GameMode.MANIA,
         params.model_dump(exclude_none=True)
-    )
\ No newline at end of file
+    )
+
+async def simulate_batch_item(index: int, item: BatchScoreItem, semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """
+    Simulate one batch entry, turning any failure into a per-item error
+    """
+    try:
+        params = SCORE_PARAMS_MODELS[item.mode].model_validate(item.params)
+    except ValidationError as e:
+        return {
+            "index": index,
+            "error": {"status_code": 422, "detail": e.errors(include_url=False, include_context=False)},
+        }
+
+    async with semaphore:
+        try:
+            score = await simulate_score(item.mode, params.model_dump(exclude_none=True))
+        except HTTPException as e:
+            return {"index": index, "error": {"status_code": e.status_code, "detail": e.detail}}
+        except (osu_api.OsuApiUnavailable, calculator.CalculatorUnavailable) as e:
+            return {"index": index, "error": {"status_code": 503, "detail": str(e)}}
+
+    return {"index": index, "score": score}
+
+@score_simulator_router.post("/simulate/batch")
+async def simulate_batch(params: BatchScoreParams):
+    """Simulate a mixed list of scores concurrently, with one result or error per item"""
+    if len(params.items) > SIMULATION_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"A batch can contain at most {SIMULATION_BATCH_MAX_ITEMS} scores"
+        )
+
+    semaphore = asyncio.Semaphore(SIMULATION_BATCH_CONCURRENCY)
+    results = await asyncio.gather(
+        *(simulate_batch_item(i, item, semaphore) for i, item in enumerate(params.items))
+    )
+    return FastJSONResponse({"results": results})
+
+@score_simulator_router.post("/sweep/osu")
+async def sweep_osu_accuracy(params: AccuracySweepParams):
+    """pp of an osu! standard score over a grid of accuracies and miss counts, computed locally"""
+    if len(params.accuracies) * len(params.misses) > ACCURACY_SWEEP_MAX_POINTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"A sweep can contain at most {ACCURACY_SWEEP_MAX_POINTS} points"
+        )
+
+    try:
+        attributes = await get_difficulty_attributes(params.beatmapId, params.mods, GameMode.OSU.value)
+    except osu_api.OsuApiUnavailable:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "message": f"Could not retrieve difficulty attributes for beatmap {params.beatmapId}",
+                "error": str(e)
+            }
+        )
+
+    missing = pp_formula.missing_attributes(attributes)
+    if missing:
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "message": f"Beatmap {params.beatmapId} cannot be swept as osu! standard",
+                "missing_attributes": missing,
+            }
+        )
+
+    pp = pp_formula.osu_accuracy_sweep(attributes, params.mods, params.accuracies, params.misses, params.combo)
+    return {
+        "beatmap_id": params.beatmapId,
+        "mods": params.mods,
+        "star_rating": attributes["star_rating"],
+        "max_combo": attributes["max_combo"],
+        "accuracies": params.accuracies,
+        "misses": params.misses,
+        # One row per miss count, one column per accuracy
+        "pp": pp.tolist(),
+    }
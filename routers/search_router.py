@@ -1,39 +1,80 @@
+import asyncio
 import os
-from ossapi import Ossapi
-from fastapi import APIRouter
-from dotenv import load_dotenv
+from typing import Optional
+
+from fastapi import APIRouter, Request
+
+from routers.user_data_router import user_id_cache
+from services import beatmap_index, osu_api
+from services.beatmaps import remember_beatmaps
+from services.cache import SingleFlight, create_cache
+from services.responses import etag_response
 
-load_dotenv()
 search_router = APIRouter()
 
-api = Ossapi(int(os.getenv("OSU_CLIENT_ID")), os.getenv("OSU_CLIENT_SECRET"))
+# User search results are cached briefly per normalized query, for typeahead
+USER_SEARCH_CACHE_SIZE = int(os.getenv("USER_SEARCH_CACHE_SIZE", "5000"))
+USER_SEARCH_CACHE_TTL = float(os.getenv("USER_SEARCH_CACHE_TTL", "30"))
+# How long browsers and CDNs may reuse search responses, in seconds. Ranked beatmaps hardly
+# change, so beatmap search results are kept much longer than user search results
+SEARCH_USER_HTTP_MAX_AGE = int(os.getenv("SEARCH_USER_HTTP_MAX_AGE", "300"))
+SEARCH_BEATMAP_HTTP_MAX_AGE = int(os.getenv("SEARCH_BEATMAP_HTTP_MAX_AGE", "3600"))
+
+user_search_cache = create_cache(maxsize=USER_SEARCH_CACHE_SIZE, ttl=USER_SEARCH_CACHE_TTL, name="user_search")
+_inflight = SingleFlight()
+
+
+async def search_users(query: str):
+    users = await osu_api.search(query, mode="user")
+    users = users.users
+    users_data = []
+    for user in users.data:
+        users_data.append({
+            "username": user.username,
+            "avatar_url": user.avatar_url,
+            "osu_id": user.id,
+            "country_code": user.country_code,
+        })
+    # Users picked from the search results skip the username lookup later on
+    await user_id_cache.aadd_many({user.username.lower(): user.id for user in users.data})
+
+    await user_search_cache.aset(query, users_data)
+    return users_data
+
 
 @search_router.get("/user")
-async def get_user_info(query: str):
+async def get_user_info(query: str, request: Request):
     try:
-        users = api.search(query, mode="user")
-        users = users.users.data
-        users_data = []
-        for user in users:
-            users_data.append({
-                "username": user.username,
-                "avatar_url": user.avatar_url,
-                "osu_id": user.id,
-                "country_code": user.country_code,
-            })
-
-        return users_data
+        normalized_query = query.strip().lower()
+
+        users_data = await user_search_cache.aget(normalized_query)
+        if users_data is None:
+            users_data = await _inflight.do(normalized_query, lambda: search_users(normalized_query))
 
+    except osu_api.OsuApiUnavailable:
+        raise
     except Exception as e:
         return {
             "error": str(e)
         }
 
+    return etag_response(request, users_data, SEARCH_USER_HTTP_MAX_AGE)
+
 
 @search_router.get("/beatmap")
-async def get_beatmaps(query: str, mode: int = 0):
+async def get_beatmaps(request: Request, query: str, mode: int = 0, min_stars: Optional[float] = None, max_stars: Optional[float] = None):
     try:
-        beatmapsets = api.search_beatmapsets(query, mode=mode, category="ranked")
+        # Served from the local catalog once it holds every ranked beatmapset
+        if await asyncio.to_thread(beatmap_index.is_ready):
+            beatmapsets_data = await asyncio.to_thread(beatmap_index.search, query, mode, min_stars, max_stars)
+            await remember_beatmaps(
+                (beatmap["beatmap_id"], data["title"], data["artist"], beatmap["version"])
+                for data in beatmapsets_data
+                for beatmap in data["beatmaps"]
+            )
+            return etag_response(request, beatmapsets_data, SEARCH_BEATMAP_HTTP_MAX_AGE)
+
+        beatmapsets = await osu_api.search_beatmapsets(query, mode=mode, category="ranked")
         beatmapsets = beatmapsets.beatmapsets
         beatmapsets_data = []
         for beatmapset in beatmapsets:
@@ -46,14 +87,26 @@ async def get_beatmaps(query: str, mode: int = 0):
                 "beatmaps": []
             }
             for beatmap in beatmapset.beatmaps:
+                if min_stars is not None and beatmap.difficulty_rating < min_stars:
+                    continue
+                if max_stars is not None and beatmap.difficulty_rating > max_stars:
+                    continue
                 data["beatmaps"].append({
                     "beatmap_id": beatmap.id,
                     "version": beatmap.version,
                     "stars": beatmap.difficulty_rating,
                 })
-            beatmapsets_data.append(data)
+            if data["beatmaps"]:
+                beatmapsets_data.append(data)
 
-        return beatmapsets_data
+        await remember_beatmaps(
+            (beatmap.id, beatmapset.title, beatmapset.artist, beatmap.version)
+            for beatmapset in beatmapsets
+            for beatmap in beatmapset.beatmaps
+        )
+        return etag_response(request, beatmapsets_data, SEARCH_BEATMAP_HTTP_MAX_AGE)
+    except osu_api.OsuApiUnavailable:
+        raise
     except Exception as e:
         return {
             "error": str(e)
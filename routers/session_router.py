@@ -0,0 +1,110 @@
+from typing import Any, Dict
+
+import httpx
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+from routers.score_simulator_router import UserProfileParams, UserScore
+from routers.user_update_router import (
+    ScoreEdit,
+    apply_delete_score,
+    apply_new_score,
+    update_profile_from_top_plays,
+)
+from services import sessions
+from services.responses import FastJSONResponse
+
+session_router = APIRouter()
+
+class SessionParams(BaseModel):
+    profile: UserProfileParams
+    scores: list[UserScore]
+
+def session_not_found(token: str) -> HTTPException:
+    return HTTPException(
+        status_code=404,
+        detail=f"Session '{token}' not found or expired"
+    )
+
+async def get_session_or_404(token: str) -> sessions.TheorizerSession:
+    session = await sessions.get_session(token)
+    if session is None:
+        raise session_not_found(token)
+    return session
+
+async def apply_session_edits(token: str, edits: list[ScoreEdit]) -> Dict[str, Any]:
+    """
+    Apply edits to a session and return only what changed: the profile fields, the scores
+    that were added, the new weight of scores that only moved, and the ids of removed scores
+    """
+    async with sessions.session_lock(token):
+        # Loaded under the lock, so that it holds the previous edits
+        session = await sessions.load_session(token)
+        if session is None:
+            raise session_not_found(token)
+        before = session.profile.model_dump()
+
+        changed = False
+        for edit in edits:
+            if edit.new_score is not None:
+                changed |= apply_new_score(session.profile, session.top_plays, edit.new_score)
+            else:
+                changed |= apply_delete_score(session.profile, session.top_plays, edit.score_id) is not None
+
+        try:
+            if changed:
+                await update_profile_from_top_plays(session.profile, session.top_plays, session.mode)
+        except httpx.RequestError as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Unexpected error: {str(e)}"
+            )
+
+        after = session.profile.model_dump()
+        changed_scores, removed_ids = session.top_plays.pop_changes()
+        await sessions.save_session(token, session)
+
+    # The client already has every score it did not just add, so those only need their new weight
+    # (actual_pp is pp * weight / 100)
+    added_ids = {edit.new_score.id for edit in edits if edit.new_score is not None}
+    return {
+        "profile": {key: value for key, value in after.items() if before[key] != value},
+        "scores": [score for score in changed_scores if score.id in added_ids],
+        "weights": {score.id: score.weight for score in changed_scores if score.id not in added_ids},
+        "removed_ids": removed_ids,
+    }
+
+@session_router.post("")
+async def create_session(params: SessionParams, mode: int = 0):
+    """Start a theorizer session holding the profile and scores server-side"""
+    token = await sessions.create_session(params.profile, params.scores, mode)
+    return {"token": token}
+
+@session_router.get("/{token}")
+async def get_session(token: str):
+    """Full current state of a session"""
+    session = await get_session_or_404(token)
+    return FastJSONResponse({
+        "profile": session.profile,
+        "scores": session.top_plays.scores()
+    })
+
+@session_router.delete("/{token}")
+async def close_session(token: str):
+    await sessions.close_session(token)
+    return {"token": token}
+
+@session_router.post("/{token}/scores")
+async def add_session_score(token: str, new_score: UserScore):
+    """Add a score to the session, returning only what changed"""
+    return FastJSONResponse(await apply_session_edits(token, [ScoreEdit(new_score=new_score)]))
+
+@session_router.delete("/{token}/scores/{score_id}")
+async def delete_session_score(token: str, score_id: int):
+    """Delete a theorized score from the session, returning only what changed"""
+    return FastJSONResponse(await apply_session_edits(token, [ScoreEdit(score_id=score_id)]))
+
+@session_router.post("/{token}/edits")
+async def apply_session_score_edits(token: str, edits: list[ScoreEdit]):
+    """Apply several adds and deletes to the session, returning only what changed"""
+    return FastJSONResponse(await apply_session_edits(token, edits))
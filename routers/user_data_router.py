@@ -1,17 +1,87 @@
-from fastapi import APIRouter, HTTPException
-from ossapi import Ossapi, UserLookupKey, ScoreType, GameMode
-from dotenv import load_dotenv
+import asyncio
 import os
 
-load_dotenv()
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from ossapi import UserLookupKey, ScoreType, GameMode
+
+from services import difficulty, osu_api
+from services.beatmaps import remember_beatmaps
+from services.responses import dump_json, etag_response
+from services.cache import SingleFlight, create_cache
+
 user_data_router = APIRouter()
 
-api = Ossapi(int(os.getenv("OSU_CLIENT_ID")), os.getenv("OSU_CLIENT_SECRET"))
+# Profiles and top scores are cached briefly per (username, mode), user ids for much longer
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "2000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_ID_CACHE_TTL = float(os.getenv("USER_ID_CACHE_TTL", "86400"))
+
+user_info_cache = create_cache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, name="user_info")
+user_scores_cache = create_cache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, name="user_scores")
+user_id_cache = create_cache(maxsize=USER_CACHE_SIZE * 5, ttl=USER_ID_CACHE_TTL, name="user_id")
+# How long browsers and CDNs may reuse a profile or top scores response, in seconds
+USER_HTTP_MAX_AGE = int(os.getenv("USER_HTTP_MAX_AGE", "60"))
+# Concurrent identical lookups share one upstream fetch
+_inflight = SingleFlight()
+
+# Modes of the overview, by the names used in the routes
+OVERVIEW_MODES = {
+    "osu": GameMode.OSU,
+    "taiko": GameMode.TAIKO,
+    "catch": GameMode.CATCH,
+    "mania": GameMode.MANIA,
+}
+
+
+def _cache_key(name: str, game_mode: GameMode) -> tuple[str, str]:
+    # osu! usernames are case insensitive
+    return name.lower(), game_mode.value
+
+
+async def resolve_user_id(name: str) -> int:
+    user_id = await user_id_cache.aget(name.lower())
+    if user_id is not None:
+        return user_id
+    return await _inflight.do(("id", name.lower()), lambda: _fetch_user_id(name))
+
+
+async def _fetch_user_id(name: str) -> int:
+    try:
+        user = await osu_api.user(name, key=UserLookupKey.USERNAME)
+    except osu_api.OsuApiUnavailable:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "message": f"User '{name}' not found",
+                "error": str(e)
+            }
+        )
+
+    await user_id_cache.aset(name.lower(), user.id)
+    return user.id
 
 
 async def get_user_info(name: str, game_mode: GameMode = GameMode.OSU):
+    key = _cache_key(name, game_mode)
+    info = await user_info_cache.aget(key)
+    if info is not None:
+        return info
+    return await _inflight.do(("info",) + key, lambda: _fetch_user_info(name, game_mode))
+
+
+async def _fetch_user_info(name: str, game_mode: GameMode):
+    # Looked up by id once it is known, the username is only resolved once
+    user_id = await user_id_cache.aget(name.lower())
     try:
-        user = api.user(name, key=UserLookupKey.USERNAME, mode=game_mode)
+        if user_id is not None:
+            user = await osu_api.user(user_id, key=UserLookupKey.ID, mode=game_mode)
+        else:
+            user = await osu_api.user(name, key=UserLookupKey.USERNAME, mode=game_mode)
+    except osu_api.OsuApiUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=404,
@@ -56,23 +126,30 @@ async def get_user_info(name: str, game_mode: GameMode = GameMode.OSU):
         "level": user.statistics.level.current,
         "level_progress": user.statistics.level.progress,
     }
+    await user_id_cache.aset(name.lower(), user.id)
+    await user_info_cache.aset(_cache_key(name, game_mode), response)
     return response
 
 
 async def get_scores(name: str, game_mode: GameMode = GameMode.OSU):
-    try:
-        user = api.user(name, key=UserLookupKey.USERNAME)
-    except Exception as e:
-        raise HTTPException(
-            status_code=404,
-            detail={
-                "message": f"User '{name}' not found",
-                "error": str(e)
-            }
-        )
+    key = _cache_key(name, game_mode)
+    scores = await user_scores_cache.aget(key)
+    if scores is not None:
+        return scores
+    return await _inflight.do(("scores",) + key, lambda: _fetch_scores(name, game_mode))
+
+
+async def fetch_best_scores(name: str, game_mode: GameMode):
+    """
+    Best scores of a user as returned by the osu! API, with their beatmap metadata remembered
+    """
+    # Skips the username lookup entirely when the id is already known
+    user_id = await resolve_user_id(name)
 
     try:
-        scores = api.user_scores(user.id, type=ScoreType.BEST, mode=game_mode, limit=100)
+        scores = await osu_api.user_scores(user_id, type=ScoreType.BEST, mode=game_mode, limit=100)
+    except osu_api.OsuApiUnavailable:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=404,
@@ -82,73 +159,163 @@ async def get_scores(name: str, game_mode: GameMode = GameMode.OSU):
             }
         )
 
+    # The scores come with their beatmap metadata, keep it for score simulations
+    await remember_beatmaps(
+        (score.beatmap.id, score.beatmapset.title, score.beatmapset.artist, score.beatmap.version)
+        for score in scores
+    )
+    return scores
+
+
+def format_score(score) -> dict:
+    mods = [mod.acronym for mod in score.mods]
+    return {
+        "is_true_score": True,
+        "accuracy": score.accuracy * 100,
+        "total_hits": (score.statistics.great or 0) +
+                      (score.statistics.good or 0) +
+                      (score.statistics.ok or 0) +
+                      (score.statistics.meh or 0) +
+                      (score.statistics.perfect or 0) +
+                      (score.statistics.small_tick_hit or 0) +
+                      (score.statistics.large_tick_hit or 0) +
+                      (score.statistics.slider_tail_hit or 0),
+        "score": score.total_score,
+        "id": score.id,
+        "beatmap_url": score.beatmap.url,
+        "title": score.beatmapset.title,
+        "artist": score.beatmapset.artist,
+        "version": score.beatmap.version,
+        "date": score.ended_at,
+        "mods": mods,
+        "pp": score.pp,
+        "max_combo": score.max_combo,
+        "grade": score.rank.name,
+        "weight": score.weight.percentage,
+        "actual_pp": score.weight.pp,
+    }
+
+
+async def _fetch_scores(name: str, game_mode: GameMode):
+    scores = await fetch_best_scores(name, game_mode)
+
     if not scores:
+        await user_scores_cache.aset(_cache_key(name, game_mode), [])
         return []
 
-    returned_scores = []
-    for score in scores:
-        mods = [mod.acronym for mod in score.mods]
-        formatted_score = {
-            "is_true_score": True,
-            "accuracy": score.accuracy * 100,
-            "total_hits": (score.statistics.great or 0) +
-                          (score.statistics.good or 0) +
-                          (score.statistics.ok or 0) +
-                          (score.statistics.meh or 0) +
-                          (score.statistics.perfect or 0) +
-                          (score.statistics.small_tick_hit or 0) +
-                          (score.statistics.large_tick_hit or 0) +
-                          (score.statistics.slider_tail_hit or 0),
-            "score": score.total_score,
-            "id": score.id,
-            "beatmap_url": score.beatmap.url,
-            "title": score.beatmapset.title,
-            "artist": score.beatmapset.artist,
-            "version": score.beatmap.version,
-            "date": score.ended_at,
-            "mods": mods,
-            "pp": score.pp,
-            "max_combo": score.max_combo,
-            "grade": score.rank.name,
-            "weight": score.weight.percentage,
-            "actual_pp": score.weight.pp,
-        }
-        returned_scores.append(formatted_score)
+    returned_scores = [format_score(score) for score in scores]
+    await user_scores_cache.aset(_cache_key(name, game_mode), returned_scores)
 
+    # Only osu!standard sweeps use the difficulty attributes
+    if difficulty.PREFETCH_DIFFICULTY and game_mode == GameMode.OSU:
+        difficulty.prefetch_difficulty_attributes([
+            (score.beatmap.id, [mod.acronym for mod in score.mods])
+            for score in scores[:difficulty.PREFETCH_DIFFICULTY_COUNT]
+        ])
     return returned_scores
 
 
+async def get_profile(name: str, game_mode: GameMode = GameMode.OSU):
+    """
+    Profile info and best scores together, resolving the user only once
+    """
+    if await user_id_cache.aget(name.lower()) is None:
+        # The profile lookup resolves the user id, which the scores lookup then reuses
+        info = await get_user_info(name, game_mode)
+        scores = await get_scores(name, game_mode)
+    else:
+        info, scores = await asyncio.gather(get_user_info(name, game_mode), get_scores(name, game_mode))
+
+    return {
+        "info": info,
+        "scores": scores,
+    }
+
+
+async def _overview_block(mode_name: str, game_mode: GameMode, name: str) -> dict:
+    try:
+        return {"mode": mode_name, "info": await get_user_info(name, game_mode)}
+    except HTTPException as e:
+        return {"mode": mode_name, "error": {"status_code": e.status_code, "detail": e.detail}}
+    except osu_api.OsuApiUnavailable as e:
+        return {"mode": mode_name, "error": {"status_code": 503, "detail": str(e)}}
+
+
+async def _overview_lines(name: str):
+    tasks = [
+        asyncio.create_task(_overview_block(mode_name, game_mode, name))
+        for mode_name, game_mode in OVERVIEW_MODES.items()
+    ]
+    try:
+        for next_block in asyncio.as_completed(tasks):
+            yield dump_json(await next_block) + b"\n"
+    finally:
+        # The client went away, stop fetching for it
+        for task in tasks:
+            task.cancel()
+
+
+
+@user_data_router.get("/overview/{name}")
+async def get_user_overview(name: str):
+    """
+    Profile info of all four modes, fetched concurrently and streamed as NDJSON, one line per
+    mode in the order they arrive
+    """
+    # Resolved before the response starts, an unknown user is still a plain 404
+    await resolve_user_id(name)
+    return StreamingResponse(_overview_lines(name), media_type="application/x-ndjson")
+
+
 
 @user_data_router.get("/info/{name}/osu")
-async def get_user_info_osu(name: str):
-    return await get_user_info(name, GameMode.OSU)
+async def get_user_info_osu(name: str, request: Request):
+    return etag_response(request, await get_user_info(name, GameMode.OSU), USER_HTTP_MAX_AGE)
 
 @user_data_router.get("/info/{name}/taiko")
-async def get_user_info_taiko(name: str):
-    return await get_user_info(name, GameMode.TAIKO)
+async def get_user_info_taiko(name: str, request: Request):
+    return etag_response(request, await get_user_info(name, GameMode.TAIKO), USER_HTTP_MAX_AGE)
 
 @user_data_router.get("/info/{name}/catch")
-async def get_user_info_fruits(name: str):
-    return await get_user_info(name, GameMode.CATCH)
+async def get_user_info_fruits(name: str, request: Request):
+    return etag_response(request, await get_user_info(name, GameMode.CATCH), USER_HTTP_MAX_AGE)
 
 @user_data_router.get("/info/{name}/mania")
-async def get_user_info_mania(name: str):
-    return await get_user_info(name, GameMode.MANIA)
+async def get_user_info_mania(name: str, request: Request):
+    return etag_response(request, await get_user_info(name, GameMode.MANIA), USER_HTTP_MAX_AGE)
 
 
 
 @user_data_router.get("/scores/{name}/osu")
-async def get_user_scores_osu(name: str):
-    return await get_scores(name, GameMode.OSU)
+async def get_user_scores_osu(name: str, request: Request):
+    return etag_response(request, await get_scores(name, GameMode.OSU), USER_HTTP_MAX_AGE)
 
 @user_data_router.get("/scores/{name}/taiko")
-async def get_user_scores_taiko(name: str):
-    return await get_scores(name, GameMode.TAIKO)
+async def get_user_scores_taiko(name: str, request: Request):
+    return etag_response(request, await get_scores(name, GameMode.TAIKO), USER_HTTP_MAX_AGE)
 
 @user_data_router.get("/scores/{name}/catch")
-async def get_user_scores_fruits(name: str):
-    return await get_scores(name, GameMode.CATCH)
+async def get_user_scores_fruits(name: str, request: Request):
+    return etag_response(request, await get_scores(name, GameMode.CATCH), USER_HTTP_MAX_AGE)
 
 @user_data_router.get("/scores/{name}/mania")
-async def get_user_scores_mania(name: str):
-    return await get_scores(name, GameMode.MANIA)
+async def get_user_scores_mania(name: str, request: Request):
+    return etag_response(request, await get_scores(name, GameMode.MANIA), USER_HTTP_MAX_AGE)
+
+
+
+@user_data_router.get("/profile/{name}/osu")
+async def get_user_profile_osu(name: str, request: Request):
+    return etag_response(request, await get_profile(name, GameMode.OSU), USER_HTTP_MAX_AGE)
+
+@user_data_router.get("/profile/{name}/taiko")
+async def get_user_profile_taiko(name: str, request: Request):
+    return etag_response(request, await get_profile(name, GameMode.TAIKO), USER_HTTP_MAX_AGE)
+
+@user_data_router.get("/profile/{name}/catch")
+async def get_user_profile_fruits(name: str, request: Request):
+    return etag_response(request, await get_profile(name, GameMode.CATCH), USER_HTTP_MAX_AGE)
+
+@user_data_router.get("/profile/{name}/mania")
+async def get_user_profile_mania(name: str, request: Request):
+    return etag_response(request, await get_profile(name, GameMode.MANIA), USER_HTTP_MAX_AGE)
@@ -1,14 +1,43 @@
-import math
+import asyncio
+import os
+from typing import Annotated, Optional
 
 import httpx
+import ossapi
 from fastapi import HTTPException, APIRouter
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, model_validator
 
 from routers.pp_calc_router import convert_pp_to_rank
-from routers.score_simulator_router import UserProfileParams, UserScore
+from routers.score_simulator_router import (
+    BatchScoreItem, GameMode, UserProfileParams, UserScore, simulate_batch_item,
+)
+from routers.user_data_router import fetch_best_scores, format_score, get_user_info
+from services import calculator, rank_index
+from services.play_gain import PlayGainModel
+from services.responses import FastJSONResponse, dump_json
+from services.top_plays import TopPlays
 
 user_update_router = APIRouter()
 
+# Bonus pp rewarded for setting many scores on different ranked beatmaps (TODO: Calculate this properly)
+BONUS_PP = 416
+
+# Maximum number of candidate pp values in one /update/query request
+PLAY_QUERY_MAX_CANDIDATES = int(os.getenv("PLAY_QUERY_MAX_CANDIDATES", "10000"))
+# Largest pp value accepted by /update/query, far above any real play or profile
+PLAY_QUERY_MAX_PP = 1_000_000
+# Simulations run at the same time by one /update/recalculate request
+RECALCULATE_CONCURRENCY = int(os.getenv("RECALCULATE_CONCURRENCY", "8"))
+
+OSU_API_MODES = {
+    GameMode.OSU: ossapi.GameMode.OSU,
+    GameMode.TAIKO: ossapi.GameMode.TAIKO,
+    GameMode.CATCH: ossapi.GameMode.CATCH,
+    GameMode.MANIA: ossapi.GameMode.MANIA,
+}
+RULESET_IDS = {GameMode.OSU: 0, GameMode.TAIKO: 1, GameMode.CATCH: 2, GameMode.MANIA: 3}
+
 class FullUserParams(BaseModel):
     profile: UserProfileParams
     scores: list[UserScore]
@@ -19,80 +48,60 @@ class FullUserParamsDel(BaseModel):
     scores: list[UserScore]
     score_id: int
 
+class ScoreEdit(BaseModel):
+    # Either a score to add or the id of a theorized score to delete
+    new_score: Optional[UserScore] = None
+    score_id: Optional[int] = None
+
+    @model_validator(mode="after")
+    def check_one_edit(self):
+        if (self.new_score is None) == (self.score_id is None):
+            raise ValueError("An edit needs exactly one of 'new_score' or 'score_id'")
+        return self
+
+class FullUserParamsBatch(BaseModel):
+    profile: UserProfileParams
+    scores: list[UserScore]
+    edits: list[ScoreEdit]
+
+QueryPP = Annotated[float, Field(ge=0, le=PLAY_QUERY_MAX_PP, allow_inf_nan=False)]
+
+class PlayQueryParams(BaseModel):
+    scores: list[UserScore]
+    # pp values of hypothetical new plays to evaluate
+    candidates: list[QueryPP] = []
+    # Profile pp or global rank to reach with a single new play
+    target_pp: Optional[QueryPP] = None
+    target_rank: Optional[int] = Field(default=None, ge=1)
+
+class RecalculateParams(BaseModel):
+    username: str
+    mode: GameMode = GameMode.OSU
+    # Transformations applied to every top play
+    full_combo: bool = False
+    remove_misses: bool = False
+    add_mods: list[str] = []
+    remove_mods: list[str] = []
+
+    @model_validator(mode="after")
+    def check_transformation(self):
+        if not (self.full_combo or self.remove_misses or self.add_mods or self.remove_mods):
+            raise ValueError("A recalculation needs at least one transformation")
+        return self
+
 @user_update_router.post("/new")
 async def new_score(params: FullUserParams, mode: int = 0):
     try:
-        # Copy the user profile and scores
-        profile = params.profile.model_copy()
-        scores = [score.model_copy() for score in params.scores]
-        new_score_copy = params.new_score
-
-        # Sort scores by weight (descending)
-        scores.sort(key=lambda x: x.weight, reverse=True)
-
-        # Check if score is worth enough pp to be in top 100
-        if len(scores) >= 100 and new_score_copy.pp <= scores[99].pp:
-            # If not, return the profile and scores unchanged
-            return {
-                "profile": profile,
-                "scores": scores
-            }
+        profile = params.profile
+        top_plays = TopPlays(params.scores)
 
+        if apply_new_score(profile, top_plays, params.new_score):
+            await update_profile_from_top_plays(profile, top_plays, mode)
 
-        # Flag to track if we're replacing an existing score
-        replaced_score = None
-
-        # Check if we're replacing an existing score
-        for i, score in enumerate(scores):
-            if score.beatmap_url == new_score_copy.beatmap_url:
-                if score.pp < new_score_copy.pp:
-                    # Store the old score before replacing
-                    replaced_score = score
-                    # Replace the score
-                    scores[i] = new_score_copy
-                    # Put the replaced score at the end of the list
-                    scores.append(replaced_score)
-                break
-        else:
-            # If no existing score found, add the new score at the right index
-            index = 0
-            for i, score in enumerate(scores):
-                if score.pp < new_score_copy.pp:
-                    index = i
-                    break
-            scores.insert(index, new_score_copy)
-
-        await update_profile_and_scores(profile, scores, mode)
-
-        # Update specific stats based on whether we're replacing a score or adding a new one
-        if replaced_score:
-            # Subtract old score's stats
-            remove_score_grade_from_profile(profile, replaced_score)
-        else:
-            # If it's a new score, increment play count
-            profile.statistics.play_count += 1
-
-        # Add new score's stats
-        profile.statistics.ranked_score += new_score_copy.score
-        profile.statistics.total_hits += new_score_copy.max_combo
-        profile.statistics.maximum_combo = max(profile.statistics.maximum_combo, new_score_copy.max_combo)
-
-        # Increment grade count for new score
-        if new_score_copy.grade == "SS":
-            profile.grade_counts.SS += 1
-        elif new_score_copy.grade == "SSH":
-            profile.grade_counts.SSH += 1
-        elif new_score_copy.grade == "S":
-            profile.grade_counts.S += 1
-        elif new_score_copy.grade == "SH":
-            profile.grade_counts.SH += 1
-        elif new_score_copy.grade == "A":
-            profile.grade_counts.A += 1
-
-        return {
+        return FastJSONResponse({
             "profile": profile,
-            "scores": scores
-        }
+            "scores": top_plays.scores()
+        })
 
     except httpx.RequestError as e:
         raise HTTPException(
@@ -104,30 +113,45 @@ async def new_score(params: FullUserParams, mode: int = 0):
 @user_update_router.delete("/new")
 async def delete_score(params: FullUserParamsDel, mode: int = 0):
     try:
-        # Copy the user profile and scores
-        profile = params.profile.model_copy()
-        scores = [score.model_copy() for score in params.scores]
+        profile = params.profile
+        top_plays = TopPlays(params.scores)
 
-        score_to_delete = None
-        for i, score in enumerate(scores):
-            if (not score.is_true_score) & (score.id == params.score_id):
-                score_to_delete = score
-                scores.pop(i)
-                break
+        apply_delete_score(profile, top_plays, params.score_id)
+        await update_profile_from_top_plays(profile, top_plays, mode)
 
-        await update_profile_and_scores(profile, scores, mode)
+        return FastJSONResponse({
+            "profile": profile,
+            "scores": top_plays.scores()
+        })
+
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Unexpected error: {str(e)}"
+        )
 
-        # Subtract old score's stats
-        if score_to_delete:
-            profile.statistics.total_hits -= score_to_delete.max_combo
-            profile.statistics.ranked_score -= score_to_delete.score
-            remove_score_grade_from_profile(profile, score_to_delete)
-            profile.statistics.play_count -= 1
 
-        return {
+@user_update_router.post("/batch")
+async def apply_score_edits(params: FullUserParamsBatch, mode: int = 0):
+    """Apply a list of score additions and deletions in order, recomputing the profile once"""
+    try:
+        profile = params.profile
+        top_plays = TopPlays(params.scores)
+
+        changed = False
+        for edit in params.edits:
+            if edit.new_score is not None:
+                changed |= apply_new_score(profile, top_plays, edit.new_score)
+            else:
+                changed |= apply_delete_score(profile, top_plays, edit.score_id) is not None
+
+        if changed:
+            await update_profile_from_top_plays(profile, top_plays, mode)
+
+        return FastJSONResponse({
             "profile": profile,
-            "scores": scores
-        }
+            "scores": top_plays.scores()
+        })
 
     except httpx.RequestError as e:
         raise HTTPException(
@@ -135,6 +159,114 @@ async def delete_score(params: FullUserParamsDel, mode: int = 0):
             detail=f"Unexpected error: {str(e)}"
         )
 
+@user_update_router.post("/query")
+async def query_plays(params: PlayQueryParams, mode: int = 0):
+    """
+    Profile pp gain of many hypothetical plays at once, and the single play needed to reach a
+    target pp or rank, without applying anything. Ranks come from the local rank index only,
+    and are null while it has no table for the mode
+    """
+    if len(params.candidates) > PLAY_QUERY_MAX_CANDIDATES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"A query can contain at most {PLAY_QUERY_MAX_CANDIDATES} candidates"
+        )
+
+    model = PlayGainModel(TopPlays(params.scores), BONUS_PP)
+    profile_pps = model.profile_pp_with(params.candidates)
+
+    response = {
+        "profile_pp": model.profile_pp,
+        "candidates": [
+            {
+                "pp": pp,
+                "profile_pp": profile_pp,
+                "gain": profile_pp - model.profile_pp,
+                "global_rank": rank_index.pp_to_rank(profile_pp, mode),
+            }
+            for pp, profile_pp in zip(params.candidates, profile_pps.tolist())
+        ],
+    }
+
+    if params.target_pp is not None:
+        response["target_pp"] = {
+            "profile_pp": params.target_pp,
+            "required_pp": model.required_play_pp(params.target_pp),
+        }
+
+    if params.target_rank is not None:
+        target_pp = rank_index.rank_to_pp(params.target_rank, mode)
+        response["target_rank"] = {
+            "global_rank": params.target_rank,
+            "profile_pp": target_pp,
+            "required_pp": model.required_play_pp(target_pp) if target_pp is not None else None,
+        }
+
+    return response
+
+def apply_new_score(profile, top_plays, new_score) -> bool:
+    """
+    Add a score to the top plays and update the profile stats it affects.
+    Returns False if the score is not worth enough pp to be in the top 100.
+    """
+    # Check if score is worth enough pp to be in top 100
+    if len(top_plays) >= 100 and new_score.pp <= top_plays.score_at(99).pp:
+        return False
+
+    # Check if we're replacing an existing score
+    replaced_score = None
+    existing_score = top_plays.get_by_beatmap(new_score.beatmap_url)
+    if existing_score is None:
+        top_plays.add(new_score)
+    elif existing_score.pp < new_score.pp:
+        # The old score stays in the list with a weight of 0
+        replaced_score = existing_score
+        top_plays.add(new_score)
+
+    # Update specific stats based on whether we're replacing a score or adding a new one
+    if replaced_score:
+        # Subtract old score's stats
+        remove_score_grade_from_profile(profile, replaced_score)
+    else:
+        # If it's a new score, increment play count
+        profile.statistics.play_count += 1
+
+    # Add new score's stats
+    profile.statistics.ranked_score += new_score.score
+    profile.statistics.total_hits += new_score.max_combo
+    profile.statistics.maximum_combo = max(profile.statistics.maximum_combo, new_score.max_combo)
+
+    # Increment grade count for new score
+    if new_score.grade == "SS":
+        profile.grade_counts.SS += 1
+    elif new_score.grade == "SSH":
+        profile.grade_counts.SSH += 1
+    elif new_score.grade == "S":
+        profile.grade_counts.S += 1
+    elif new_score.grade == "SH":
+        profile.grade_counts.SH += 1
+    elif new_score.grade == "A":
+        profile.grade_counts.A += 1
+
+    return True
+
+def apply_delete_score(profile, top_plays, score_id):
+    """
+    Remove a theorized (not true) score from the top plays and subtract its stats from the profile
+    """
+    score_to_delete = top_plays.get_by_id(score_id)
+    if score_to_delete is None or score_to_delete.is_true_score:
+        return None
+
+    top_plays.remove(score_to_delete)
+
+    # Subtract old score's stats
+    profile.statistics.total_hits -= score_to_delete.max_combo
+    profile.statistics.ranked_score -= score_to_delete.score
+    remove_score_grade_from_profile(profile, score_to_delete)
+    profile.statistics.play_count -= 1
+    return score_to_delete
+
 def remove_score_grade_from_profile(profile, score):
     if score.grade == "SS":
         profile.grade_counts.SS -= 1
@@ -148,53 +280,118 @@ def remove_score_grade_from_profile(profile, score):
         profile.grade_counts.A -= 1
 
 async def update_profile_and_scores(profile, scores, mode=0):
-    # Sort by pp first
-    scores.sort(key=lambda x: x.pp, reverse=True)
-
-    # Track seen beatmap_urls and calculate weights
-    seen_beatmaps = set()
-    rate = 0.95
-    acc = 0
-    factor = 1
-    i = 0  # Keep track of actual position for weight calculation
-
-    for score in scores:
-        if score.beatmap_url in seen_beatmaps:
-            # Duplicate score - set weight to 0
-            score.weight = 0
-            score.actual_pp = 0
-        else:
-            # New unique score - calculate weight normally
-            score.weight = 0.95 ** i
-            score.actual_pp = score.pp * score.weight
-            score.weight *= 100
-            acc += score.accuracy/100 * factor
-            factor *= rate
-            seen_beatmaps.add(score.beatmap_url)
-            i += 1  # Only increment position counter for unique scores
-
-    # Sort again by weight (descending)
-    scores.sort(key=lambda x: x.weight, reverse=True)
-
-    # Normalize accuracy (formula taken directly from osu! codebase)
-    acc *= 100 / (20 * (1 - math.pow(rate, min(len(scores), 100))))
-
-    # Handle floating point precision edge cases
-    clamp = lambda x, y, z: max(y, min(z, x))
-    acc = clamp(acc, 0, 100)
-
-    profile.statistics.accuracy = acc
-
-    # Bonus pp rewarded for setting many scores on different ranked beatmaps (TODO: Calculate this properly)
-    bonus_pp = 416
+    # Weigh the scores and put them back in weight order (descending)
+    top_plays = TopPlays(scores)
+    scores[:] = top_plays.scores()
+    await update_profile_from_top_plays(profile, top_plays, mode)
+
+async def update_profile_from_top_plays(profile, top_plays, mode=0):
+    profile.statistics.accuracy = top_plays.accuracy
+
     # New pp
-    profile.pp = sum(score.actual_pp for score in scores) + bonus_pp
+    profile.pp = top_plays.weighted_pp + BONUS_PP
 
-    # New global rank
-    rank_json = await convert_pp_to_rank(profile.pp, mode)
-    rank = rank_json["rank"]
-    profile.global_rank = rank
-    profile.rank_history[len(profile.rank_history) - 1] = rank
+    # New global rank, the previous one is kept if the calculator cannot answer
+    try:
+        rank_json = await convert_pp_to_rank(profile.pp, mode)
+    except (HTTPException, calculator.CalculatorUnavailable) as e:
+        print(f"Could not convert {profile.pp}pp to a rank, keeping the previous rank: {e}")
+    else:
+        rank = rank_json["rank"]
+        profile.global_rank = rank
+        # Modes the user never played have no rank history
+        if profile.rank_history:
+            profile.rank_history[len(profile.rank_history) - 1] = rank
 
     # New country rank
-    profile.country_rank = 0 # As the proof it's not a real user page
\ No newline at end of file
+    profile.country_rank = 0 # As the proof it's not a real user page
+
+
+def transformed_score_params(score, params: RecalculateParams) -> dict:
+    """
+    Simulator parameters of a top play (as returned by the osu! API) with the transformations applied
+    """
+    mods = [mod.acronym for mod in score.mods if mod.acronym not in params.remove_mods]
+    mods += [mod for mod in params.add_mods if mod not in mods]
+    statistics = score.statistics
+
+    simulation = {
+        "beatmapId": score.beatmap.id,
+        "mods": mods,
+        # No combo means a full combo for the calculator
+        "combo": None if params.full_combo else score.max_combo,
+        "nmiss": 0 if params.full_combo or params.remove_misses else statistics.miss or 0,
+    }
+    if params.mode == GameMode.OSU:
+        # Hit counts rather than the accuracy, so that removed misses become great hits
+        simulation["n100"] = statistics.ok or 0
+        simulation["n50"] = statistics.meh or 0
+    elif params.mode == GameMode.TAIKO:
+        simulation["n100"] = statistics.ok or 0
+    else:
+        simulation["accPercent"] = score.accuracy * 100
+    return simulation
+
+def _user_score(score: dict) -> UserScore:
+    # Fresh scores hold their date as a datetime, and simulated ones have no weight yet
+    # (update_profile_and_scores weighs them all again)
+    return UserScore(**{"weight": 0, "actual_pp": 0, **score, "date": score["date"].isoformat()})
+
+async def _recalculation_lines(profile: UserProfileParams, top_scores: list, params: RecalculateParams):
+    semaphore = asyncio.Semaphore(RECALCULATE_CONCURRENCY)
+    tasks = [
+        asyncio.create_task(simulate_batch_item(
+            index,
+            BatchScoreItem(mode=params.mode, params=transformed_score_params(score, params)),
+            semaphore,
+        ))
+        for index, score in enumerate(top_scores)
+    ]
+    # Scores that cannot be simulated are kept as they are
+    scores = [format_score(score) for score in top_scores]
+
+    try:
+        for completed, next_result in enumerate(asyncio.as_completed(tasks), start=1):
+            result = await next_result
+            original = scores[result["index"]]
+            if "score" in result:
+                scores[result["index"]] = result["score"]
+            yield dump_json({
+                **result,
+                "completed": completed,
+                "total": len(tasks),
+                "original_id": original["id"],
+                "original_pp": original["pp"],
+            }) + b"\n"
+    finally:
+        # The client went away, stop simulating for it
+        for task in tasks:
+            task.cancel()
+
+    user_scores = [_user_score(score) for score in scores]
+    await update_profile_and_scores(profile, user_scores, RULESET_IDS[params.mode])
+    yield dump_json({"profile": profile, "scores": user_scores}) + b"\n"
+
+@user_update_router.post("/recalculate")
+async def recalculate_profile(params: RecalculateParams):
+    """
+    Simulate every top play of a user with the transformations applied ("if all my top plays were
+    FCs"), streaming one NDJSON line per score as soon as it is simulated, and a last line with the
+    recalculated profile and top plays
+    """
+    osu_api_mode = OSU_API_MODES[params.mode]
+    # The profile lookup resolves the user id, which the scores lookup then reuses
+    info = await get_user_info(params.username, osu_api_mode)
+    top_scores = await fetch_best_scores(params.username, osu_api_mode)
+
+    # Unranked users have no rank to keep should the calculator not answer
+    profile = UserProfileParams(**{
+        **info,
+        "global_rank": info["global_rank"] or 0,
+        "country_rank": info["country_rank"] or 0,
+    })
+
+    return StreamingResponse(
+        _recalculation_lines(profile, top_scores, params),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,312 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from ossapi.enums import BeatmapsetSearchSort
+from ossapi.models import Cursor
+
+from services import osu_api
+from services.file_lock import try_lock_file
+
+# Local catalog of ranked beatmapsets and their difficulties, searchable with SQLite FTS5.
+# It is filled by crawling the ranked listing newest first: a full backfill on the first
+# run, then only the pages needed to reach already indexed beatmapsets. Every
+# BEATMAP_INDEX_FULL_REFRESH_INTERVAL the whole listing is crawled again, so that star
+# ratings changed since a beatmapset was indexed are picked up.
+# Workers sharing the index elect a single crawler through a lock file next to it.
+BEATMAP_INDEX_PATH = os.getenv("BEATMAP_INDEX_PATH", "data/beatmaps.sqlite3")
+BEATMAP_INDEX_REFRESH = os.getenv("BEATMAP_INDEX_REFRESH", "true").lower() in ("1", "true", "yes")
+BEATMAP_INDEX_REFRESH_INTERVAL = float(os.getenv("BEATMAP_INDEX_REFRESH_INTERVAL", "1800"))
+BEATMAP_INDEX_FULL_REFRESH_INTERVAL = float(os.getenv("BEATMAP_INDEX_FULL_REFRESH_INTERVAL", "604800"))
+# Pause between two listing pages, to stay well under the osu! API rate limit
+BEATMAP_INDEX_PAGE_DELAY = float(os.getenv("BEATMAP_INDEX_PAGE_DELAY", "2"))
+BEATMAP_INDEX_MAX_RESULTS = 50
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS beatmapsets (
+    id INTEGER PRIMARY KEY,
+    artist TEXT NOT NULL,
+    title TEXT NOT NULL,
+    creator TEXT NOT NULL,
+    cover TEXT,
+    ranked_date TEXT
+);
+CREATE TABLE IF NOT EXISTS beatmaps (
+    id INTEGER PRIMARY KEY,
+    beatmapset_id INTEGER NOT NULL,
+    version TEXT NOT NULL,
+    mode INTEGER NOT NULL,
+    stars REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS beatmaps_beatmapset_id ON beatmaps (beatmapset_id);
+CREATE INDEX IF NOT EXISTS beatmaps_mode_stars ON beatmaps (mode, stars);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+# The rowid of a row is the id of its beatmap
+_SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS beatmap_search USING fts5(
+    artist, title, creator, version,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+_connection: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+_refresh_task: Optional[asyncio.Task] = None
+
+
+def _connect() -> sqlite3.Connection:
+    global _connection
+    if _connection is None:
+        directory = os.path.dirname(BEATMAP_INDEX_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Queries run in worker threads, waiting on the crawler's writes does not block the loop
+        _connection = sqlite3.connect(BEATMAP_INDEX_PATH, timeout=5, check_same_thread=False)
+        # WAL lets the other workers search while the crawler writes
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(_SCHEMA)
+        _migrate_search_table(_connection)
+        _connection.execute(_SEARCH_SCHEMA)
+    return _connection
+
+
+def _migrate_search_table(connection: sqlite3.Connection):
+    # Earlier indexes kept the beatmap id in an unindexed column, deleting by it scanned the
+    # whole table. The search table is rebuilt from the beatmaps, keyed by rowid
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(beatmap_search)")]
+    if "beatmap_id" not in columns:
+        return
+    with connection:
+        connection.execute("DROP TABLE beatmap_search")
+        connection.execute(_SEARCH_SCHEMA)
+        connection.execute(
+            "INSERT INTO beatmap_search (rowid, artist, title, creator, version) "
+            "SELECT b.id, s.artist, s.title, s.creator, b.version "
+            "FROM beatmaps b JOIN beatmapsets s ON s.id = b.beatmapset_id"
+        )
+
+
+def _get_meta(key: str) -> Optional[str]:
+    row = _connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_meta(key: str, value: str):
+    _connect().execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def is_ready() -> bool:
+    """
+    Whether the backfill went through the whole ranked listing at least once
+    """
+    with _lock:
+        return _get_meta("backfill_complete") == "1"
+
+
+def store_beatmapsets(beatmapsets) -> int:
+    """
+    Upsert ossapi beatmapsets and their difficulties, returning how many were already indexed
+    """
+    with _lock:
+        connection = _connect()
+        known = 0
+        with connection:
+            for beatmapset in beatmapsets:
+                if connection.execute("SELECT 1 FROM beatmapsets WHERE id = ?", (beatmapset.id,)).fetchone():
+                    known += 1
+
+                connection.execute(
+                    "INSERT OR REPLACE INTO beatmapsets (id, artist, title, creator, cover, ranked_date) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        beatmapset.id,
+                        beatmapset.artist,
+                        beatmapset.title,
+                        beatmapset.creator,
+                        beatmapset.covers.list,
+                        beatmapset.ranked_date.isoformat() if beatmapset.ranked_date else None,
+                    ),
+                )
+                for beatmap in beatmapset.beatmaps or []:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO beatmaps (id, beatmapset_id, version, mode, stars) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (beatmap.id, beatmapset.id, beatmap.version, beatmap.mode_int, beatmap.difficulty_rating),
+                    )
+                    connection.execute("DELETE FROM beatmap_search WHERE rowid = ?", (beatmap.id,))
+                    connection.execute(
+                        "INSERT INTO beatmap_search (rowid, artist, title, creator, version) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (beatmap.id, beatmapset.artist, beatmapset.title, beatmapset.creator, beatmap.version),
+                    )
+        return known
+
+
+def _fts_query(query: str) -> Optional[str]:
+    # Every word has to match as a prefix, quoted so user input cannot use FTS5 syntax
+    tokens = re.findall(r"\w+", query.lower())
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def search(query: str, mode: Optional[int] = None, min_stars: Optional[float] = None,
+           max_stars: Optional[float] = None, limit: int = BEATMAP_INDEX_MAX_RESULTS) -> list[dict]:
+    """
+    Search indexed difficulties by artist, title, creator and version, grouped by beatmapset
+    in the same shape as the /search/beatmap endpoint
+    """
+    conditions = []
+    params = []
+    fts_query = _fts_query(query)
+    if fts_query:
+        source = "beatmap_search JOIN beatmaps b ON b.id = beatmap_search.rowid"
+        conditions.append("beatmap_search MATCH ?")
+        params.append(fts_query)
+        order = "beatmap_search.rank"
+    else:
+        source = "beatmaps b"
+        order = "s.ranked_date DESC"
+    if mode is not None:
+        conditions.append("b.mode = ?")
+        params.append(mode)
+    if min_stars is not None:
+        conditions.append("b.stars >= ?")
+        params.append(min_stars)
+    if max_stars is not None:
+        conditions.append("b.stars <= ?")
+        params.append(max_stars)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    sql = (
+        "SELECT s.id, s.artist, s.title, s.creator, s.cover, b.id, b.version, b.stars "
+        f"FROM {source} JOIN beatmapsets s ON s.id = b.beatmapset_id {where} "
+        f"ORDER BY {order} LIMIT ?"
+    )
+    # Fetch enough difficulties to fill `limit` beatmapsets in the common case
+    params.append(limit * 20)
+
+    with _lock:
+        rows = _connect().execute(sql, params).fetchall()
+
+    beatmapsets_data = {}
+    for beatmapset_id, artist, title, creator, cover, beatmap_id, version, stars in rows:
+        data = beatmapsets_data.get(beatmapset_id)
+        if data is None:
+            if len(beatmapsets_data) >= limit:
+                continue
+            data = beatmapsets_data[beatmapset_id] = {
+                "artist": artist,
+                "title": title,
+                "creator": creator,
+                "cover": cover,
+                "beatmapset_id": beatmapset_id,
+                "beatmaps": []
+            }
+        data["beatmaps"].append({
+            "beatmap_id": beatmap_id,
+            "version": version,
+            "stars": stars,
+        })
+
+    return list(beatmapsets_data.values())
+
+
+async def refresh():
+    """
+    Crawl the ranked listing newest first, until reaching already indexed beatmapsets, or to
+    the end of the listing when a full crawl (backfill or periodic re-crawl) is due
+    """
+    full_crawl = await asyncio.to_thread(_full_crawl_due)
+    # An interrupted full crawl resumes from the last stored page
+    cursor = await asyncio.to_thread(_load_backfill_cursor) if full_crawl else None
+    while True:
+        result = await osu_api.search_beatmapsets(
+            category="ranked",
+            explicit_content="show",
+            sort=BeatmapsetSearchSort.RANKED_DESCENDING,
+            cursor=cursor,
+            priority=osu_api.BACKGROUND,
+        )
+        known = await asyncio.to_thread(store_beatmapsets, result.beatmapsets)
+        if not full_crawl and known == len(result.beatmapsets):
+            return
+
+        cursor = result.cursor
+        if cursor is None or not result.beatmapsets:
+            if full_crawl:
+                await asyncio.to_thread(_mark_backfill_complete)
+            return
+        if full_crawl:
+            await asyncio.to_thread(_save_backfill_cursor, cursor)
+        await asyncio.sleep(BEATMAP_INDEX_PAGE_DELAY)
+
+
+def _full_crawl_due() -> bool:
+    with _lock:
+        if _get_meta("backfill_complete") != "1" or _get_meta("backfill_cursor") is not None:
+            return True
+        last_full_crawl = float(_get_meta("full_crawl_at") or 0)
+    return time.time() - last_full_crawl >= BEATMAP_INDEX_FULL_REFRESH_INTERVAL
+
+
+def _load_backfill_cursor() -> Optional[Cursor]:
+    with _lock:
+        value = _get_meta("backfill_cursor")
+    return Cursor(**json.loads(value)) if value else None
+
+
+def _save_backfill_cursor(cursor: Cursor):
+    with _lock, _connect():
+        _set_meta("backfill_cursor", json.dumps(cursor.__dict__))
+
+
+def _mark_backfill_complete():
+    with _lock, _connect() as connection:
+        _set_meta("backfill_complete", "1")
+        _set_meta("full_crawl_at", str(time.time()))
+        connection.execute("DELETE FROM meta WHERE key = 'backfill_cursor'")
+
+
+async def _refresh_loop():
+    # Only one worker crawls, the others take over should it stop
+    crawler_lock = try_lock_file(f"{BEATMAP_INDEX_PATH}.lock")
+    while crawler_lock is None:
+        await asyncio.sleep(BEATMAP_INDEX_REFRESH_INTERVAL)
+        crawler_lock = try_lock_file(f"{BEATMAP_INDEX_PATH}.lock")
+
+    try:
+        while True:
+            try:
+                await refresh()
+            except Exception as e:
+                print(f"Beatmap index refresh failed: {e}")
+            await asyncio.sleep(BEATMAP_INDEX_REFRESH_INTERVAL)
+    finally:
+        crawler_lock.close()
+
+
+def start():
+    global _refresh_task
+    if BEATMAP_INDEX_REFRESH and _refresh_task is None:
+        _refresh_task = asyncio.create_task(_refresh_loop())
+
+
+async def stop():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None
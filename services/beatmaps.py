@@ -0,0 +1,51 @@
+import os
+from typing import Iterable
+
+from services import osu_api
+from services.cache import SingleFlight, create_cache
+
+# Ranked beatmap metadata practically never changes, so entries can live long
+BEATMAP_CACHE_SIZE = int(os.getenv("BEATMAP_CACHE_SIZE", "10000"))
+BEATMAP_CACHE_TTL = float(os.getenv("BEATMAP_CACHE_TTL", "86400"))
+
+beatmap_cache = create_cache(maxsize=BEATMAP_CACHE_SIZE, ttl=BEATMAP_CACHE_TTL, name="beatmap_metadata")
+_inflight = SingleFlight()
+
+
+async def get_beatmap_metadata(beatmap_id: int) -> dict:
+    """
+    Get the title, artist and version of a beatmap, going to the osu! API only on a cache miss
+    """
+    metadata = await beatmap_cache.aget(beatmap_id)
+    if metadata is not None:
+        return metadata
+
+    # Concurrent misses on the same beatmap share a single osu! API lookup
+    return await _inflight.do(beatmap_id, lambda: _fetch_beatmap_metadata(beatmap_id))
+
+
+async def remember_beatmaps(beatmaps: Iterable[tuple[int, str, str, str]]):
+    """
+    Keep the metadata of (beatmap id, title, artist, version) beatmaps seen in another response
+    (top scores, search results...), so that simulating a score on them does not look them up again
+    """
+    await beatmap_cache.aadd_many({
+        beatmap_id: {
+            "title": title,
+            "artist": artist,
+            "version": version,
+        }
+        for beatmap_id, title, artist, version in beatmaps
+    })
+
+
+async def _fetch_beatmap_metadata(beatmap_id: int) -> dict:
+    beatmap = await osu_api.beatmap(beatmap_id)
+    beatmapset = await osu_api.run_sync(beatmap.beatmapset)
+    metadata = {
+        "title": beatmapset.title,
+        "artist": beatmapset.artist,
+        "version": beatmap.version,
+    }
+    await beatmap_cache.aset(beatmap_id, metadata)
+    return metadata
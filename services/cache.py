@@ -0,0 +1,327 @@
+import asyncio
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional, Union
+
+_MISSING = object()
+
+# Backend of the caches made with create_cache: "memory" keeps them in each process, "sqlite"
+# shares them between the workers of one machine through the CACHE_SQLITE_PATH database
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "data/cache.sqlite3")
+# Seconds a worker waits for another one to release the database before skipping the access
+CACHE_SQLITE_TIMEOUT = float(os.getenv("CACHE_SQLITE_TIMEOUT", "0.25"))
+
+# Named caches, reported on /metrics
+CACHES: dict[str, Union["TTLCache", "SQLiteCache"]] = {}
+
+
+class TTLCache:
+    """
+    Bounded in-process cache with LRU eviction and a per-entry time to live
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: Optional[str] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        if name is not None:
+            CACHES[name] = self
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Like get, but without touching the LRU order or the hit/miss counters
+        """
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def add_many(self, items: dict[Hashable, Any], ttl: Optional[float] = None):
+        """
+        Set the entries whose key is not cached yet, leaving the others as they are
+        """
+        for key, value in items.items():
+            if key not in self:
+                self.set(key, value, ttl)
+
+    # Same async interface as SQLiteCache, for the code using either backend
+    async def aget(self, key: Hashable, default: Any = None) -> Any:
+        return self.get(key, default)
+
+    async def apeek(self, key: Hashable, default: Any = None) -> Any:
+        return self.peek(key, default)
+
+    async def aset(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self.set(key, value, ttl)
+
+    async def aadd_many(self, items: dict[Hashable, Any], ttl: Optional[float] = None):
+        self.add_many(items, ttl)
+
+    async def adelete(self, key: Hashable):
+        self.delete(key)
+
+    def delete(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key, _MISSING)
+        return entry is not _MISSING and entry[0] >= time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class SQLiteCache:
+    """
+    Cache shared by every process using the same SQLite database, with the TTLCache interface.
+    Values are pickled, expiry uses wall-clock time, and once over maxsize the entries closest
+    to expiring are evicted first.
+
+    The sync methods block on the database, async code uses the a-prefixed ones which run them
+    in a worker thread. When the database stays locked longer than CACHE_SQLITE_TIMEOUT, reads
+    miss and writes are dropped rather than holding up the request.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        cache TEXT NOT NULL,
+        key BLOB NOT NULL,
+        value BLOB NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (cache, key)
+    );
+    CREATE INDEX IF NOT EXISTS cache_entries_expires_at ON cache_entries (cache, expires_at);
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: str, path: str = CACHE_SQLITE_PATH):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        # Eviction runs every few writes rather than on each one
+        self._evict_every = max(1, min(100, maxsize // 10))
+        self._writes = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        CACHES[name] = self
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=CACHE_SQLITE_TIMEOUT, check_same_thread=False, isolation_level=None
+            )
+            # WAL lets the workers read while one of them writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(self._SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _read(self, key: Hashable) -> Any:
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT value FROM cache_entries WHERE cache = ? AND key = ? AND expires_at >= ?",
+                    (self.name, pickle.dumps(key), time.time()),
+                ).fetchone()
+        except sqlite3.OperationalError as e:
+            print(f"Cache {self.name} read skipped: {e}")
+            return _MISSING
+        return _MISSING if row is None else pickle.loads(row[0])
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._read(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        value = self._read(key)
+        return default if value is _MISSING else value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.execute(
+                    "INSERT OR REPLACE INTO cache_entries (cache, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (self.name, pickle.dumps(key), pickle.dumps(value), expires_at),
+                )
+                self._count_writes(connection, 1)
+        except sqlite3.OperationalError as e:
+            print(f"Cache {self.name} write skipped: {e}")
+
+    def add_many(self, items: dict[Hashable, Any], ttl: Optional[float] = None):
+        """
+        Set the entries whose key is not cached yet (or has expired), in a single transaction
+        """
+        if not items:
+            return
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        rows = [(self.name, pickle.dumps(key), pickle.dumps(value), expires_at, now) for key, value in items.items()]
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    connection.executemany(
+                        """
+                        INSERT INTO cache_entries (cache, key, value, expires_at) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (cache, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at
+                        WHERE cache_entries.expires_at < ?
+                        """,
+                        rows,
+                    )
+                    connection.execute("COMMIT")
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+                self._count_writes(connection, len(rows))
+        except sqlite3.OperationalError as e:
+            print(f"Cache {self.name} write skipped: {e}")
+
+    async def aget(self, key: Hashable, default: Any = None) -> Any:
+        return await asyncio.to_thread(self.get, key, default)
+
+    async def apeek(self, key: Hashable, default: Any = None) -> Any:
+        return await asyncio.to_thread(self.peek, key, default)
+
+    async def aset(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    async def aadd_many(self, items: dict[Hashable, Any], ttl: Optional[float] = None):
+        await asyncio.to_thread(self.add_many, items, ttl)
+
+    async def adelete(self, key: Hashable):
+        await asyncio.to_thread(self.delete, key)
+
+    def _count_writes(self, connection: sqlite3.Connection, count: int):
+        self._writes += count
+        if self._writes >= self._evict_every:
+            self._writes = 0
+            self._evict(connection)
+
+    def _evict(self, connection: sqlite3.Connection):
+        connection.execute(
+            "DELETE FROM cache_entries WHERE cache = ? AND expires_at < ?", (self.name, time.time())
+        )
+        connection.execute(
+            """
+            DELETE FROM cache_entries WHERE cache = ? AND key IN (
+                SELECT key FROM cache_entries WHERE cache = ?
+                ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.name, self.name, self.maxsize),
+        )
+
+    def delete(self, key: Hashable):
+        try:
+            with self._lock:
+                self._connect().execute(
+                    "DELETE FROM cache_entries WHERE cache = ? AND key = ?", (self.name, pickle.dumps(key))
+                )
+        except sqlite3.OperationalError as e:
+            print(f"Cache {self.name} delete skipped: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM cache_entries WHERE cache = ?", (self.name,))
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._read(key) is not _MISSING
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute(
+                "SELECT COUNT(*) FROM cache_entries WHERE cache = ?", (self.name,)
+            ).fetchone()[0]
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def create_cache(maxsize: int, ttl: float, name: str) -> Union[TTLCache, SQLiteCache]:
+    """
+    Named cache on the configured CACHE_BACKEND. Its keys and values must be picklable.
+    """
+    if CACHE_BACKEND == "sqlite":
+        return SQLiteCache(maxsize=maxsize, ttl=ttl, name=name)
+    if CACHE_BACKEND != "memory":
+        raise ValueError(f"Unknown CACHE_BACKEND '{CACHE_BACKEND}', expected 'memory' or 'sqlite'")
+    return TTLCache(maxsize=maxsize, ttl=ttl, name=name)
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls sharing a key so only one of them does the work
+    """
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield the shared task so one cancelled caller does not cancel it for the others
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
@@ -0,0 +1,124 @@
+import os
+from typing import Optional
+
+import httpx
+
+from services import metrics
+from services.circuit_breaker import OPEN, CircuitBreaker, CircuitOpen
+
+HELPER_URL = os.getenv("HELPER_URL", "https://that-game-tools-api-production.up.railway.app")
+API_KEY = os.getenv("TOOLS_API_KEY")
+
+# Connection pool settings for the calculator (tools) API
+CALCULATOR_MAX_CONNECTIONS = int(os.getenv("CALCULATOR_MAX_CONNECTIONS", "100"))
+CALCULATOR_MAX_KEEPALIVE = int(os.getenv("CALCULATOR_MAX_KEEPALIVE", "20"))
+CALCULATOR_KEEPALIVE_EXPIRY = float(os.getenv("CALCULATOR_KEEPALIVE_EXPIRY", "30"))
+CALCULATOR_TIMEOUT = float(os.getenv("CALCULATOR_TIMEOUT", "10"))
+CALCULATOR_CONNECT_TIMEOUT = float(os.getenv("CALCULATOR_CONNECT_TIMEOUT", "5"))
+CALCULATOR_HTTP2 = os.getenv("CALCULATOR_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Circuit breaker per calculator endpoint: after CALCULATOR_BREAKER_FAILURES consecutive
+# failures (connection errors, timeouts, 5xx), calls to it fail fast for CALCULATOR_BREAKER_RESET seconds
+CALCULATOR_BREAKER_FAILURES = int(os.getenv("CALCULATOR_BREAKER_FAILURES", "5"))
+CALCULATOR_BREAKER_RESET = float(os.getenv("CALCULATOR_BREAKER_RESET", "30"))
+
+_client: Optional[httpx.AsyncClient] = None
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+class CalculatorUnavailable(Exception):
+    """
+    The calculator endpoint is failing and its circuit is open, answered with a 503
+    """
+
+    def __init__(self, path: str, retry_after: float):
+        super().__init__(f"Calculator API is unavailable ({path}), try again later")
+        self.retry_after = retry_after
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+async def startup():
+    """
+    Create the app-wide pooled client, called from the FastAPI lifespan
+    """
+    global _client
+    if _client is not None:
+        return
+
+    http2 = CALCULATOR_HTTP2
+    if http2 and not _http2_available():
+        print("CALCULATOR_HTTP2 is set but the 'h2' package is not installed, falling back to HTTP/1.1")
+        http2 = False
+
+    _client = httpx.AsyncClient(
+        base_url=HELPER_URL,
+        headers={"x-api-key": API_KEY} if API_KEY else None,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=CALCULATOR_MAX_CONNECTIONS,
+            max_keepalive_connections=CALCULATOR_MAX_KEEPALIVE,
+            keepalive_expiry=CALCULATOR_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(CALCULATOR_TIMEOUT, connect=CALCULATOR_CONNECT_TIMEOUT),
+    )
+
+
+async def shutdown():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    if _client is None:
+        raise RuntimeError("Calculator client is not started, was the app lifespan run?")
+    return _client
+
+
+def _breaker(path: str) -> CircuitBreaker:
+    breaker = _breakers.get(path)
+    if breaker is None:
+        breaker = _breakers[path] = CircuitBreaker(CALCULATOR_BREAKER_FAILURES, CALCULATOR_BREAKER_RESET)
+    return breaker
+
+
+async def request(method: str, path: str, **kwargs) -> httpx.Response:
+    breaker = _breaker(path)
+    try:
+        breaker.before_call()
+    except CircuitOpen as e:
+        metrics.calculator_requests.inc(path=path, status="circuit_open")
+        raise CalculatorUnavailable(path, e.retry_after)
+
+    status = "error"
+    try:
+        with metrics.calculator_request_duration.time(path=path):
+            response = await get_client().request(method, path, **kwargs)
+        status = response.status_code
+        if status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+    except httpx.RequestError:
+        breaker.record_failure()
+        raise
+    finally:
+        metrics.calculator_requests.inc(path=path, status=status)
+        metrics.calculator_circuit_open.set(int(breaker.state == OPEN), path=path)
+
+
+async def get(path: str, params: Optional[dict] = None) -> httpx.Response:
+    return await request("GET", path, params=params)
+
+
+async def post(path: str, json: Optional[dict] = None) -> httpx.Response:
+    return await request("POST", path, json=json)
@@ -0,0 +1,52 @@
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("Circuit open")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency: after `failure_threshold` consecutive failures the
+    circuit opens and calls fail immediately for `reset_timeout` seconds. Then a single trial
+    call is let through, closing the circuit again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+
+    def before_call(self):
+        """
+        Raise CircuitOpen if the call must not be made
+        """
+        if self.state == CLOSED:
+            return
+        now = time.monotonic()
+        elapsed = now - self._opened_at
+        if elapsed >= self.reset_timeout:
+            # Let this call through as the trial, the others keep failing fast until it ends
+            # (or until another reset_timeout, should the trial never report back)
+            self.state = HALF_OPEN
+            self._opened_at = now
+            return
+        raise CircuitOpen(max(self.reset_timeout - elapsed, 1))
+
+    def record_success(self):
+        self.state = CLOSED
+        self._failures = 0
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            self.state = OPEN
+            self._opened_at = time.monotonic()
@@ -0,0 +1,107 @@
+import asyncio
+import os
+
+from services import osu_api
+from services.beatmaps import beatmap_cache, remember_beatmaps
+from services.cache import SingleFlight, create_cache
+
+# Difficulty attributes only depend on the beatmap, the mods and the mode, so they can live long
+DIFFICULTY_CACHE_SIZE = int(os.getenv("DIFFICULTY_CACHE_SIZE", "5000"))
+DIFFICULTY_CACHE_TTL = float(os.getenv("DIFFICULTY_CACHE_TTL", "604800"))
+# Difficulty attributes of a user's top maps can be fetched in the background when their scores
+# are loaded, so that accuracy sweeps on them are immediate. Off by default, as it spends osu!
+# API requests on maps that may never be swept.
+PREFETCH_DIFFICULTY = os.getenv("PREFETCH_DIFFICULTY", "false").lower() in ("1", "true", "yes")
+PREFETCH_DIFFICULTY_COUNT = int(os.getenv("PREFETCH_DIFFICULTY_COUNT", "10"))
+PREFETCH_DIFFICULTY_CONCURRENCY = int(os.getenv("PREFETCH_DIFFICULTY_CONCURRENCY", "2"))
+
+difficulty_cache = create_cache(maxsize=DIFFICULTY_CACHE_SIZE, ttl=DIFFICULTY_CACHE_TTL, name="difficulty_attributes")
+_inflight = SingleFlight()
+_prefetch_tasks = set()
+# Shared by every prefetch, so that they never take much of the osu! API queue
+_prefetch_semaphore = asyncio.Semaphore(PREFETCH_DIFFICULTY_CONCURRENCY)
+
+# Our mode names to osu! API ruleset names
+RULESETS = {
+    "osu": "osu",
+    "taiko": "taiko",
+    "catch": "fruits",
+    "mania": "mania",
+}
+
+# Attributes returned by the osu! API, depending on the mode
+ATTRIBUTE_NAMES = (
+    "max_combo", "star_rating",
+    "aim_difficulty", "speed_difficulty", "speed_note_count", "flashlight_difficulty", "slider_factor",
+    "approach_rate", "overall_difficulty",
+    "stamina_difficulty", "rhythm_difficulty", "colour_difficulty",
+    "great_hit_window", "score_multiplier",
+)
+
+
+def _mods_key(mods: list[str]) -> tuple[str, ...]:
+    return tuple(sorted(mod.upper() for mod in mods))
+
+
+async def get_difficulty_attributes(
+    beatmap_id: int, mods: list[str], mode: str = "osu", priority: int = osu_api.INTERACTIVE
+) -> dict:
+    """
+    Difficulty attributes of a beatmap with the given mods, plus its hit object counts
+    """
+    key = (beatmap_id, _mods_key(mods), mode)
+    attributes = await difficulty_cache.aget(key)
+    if attributes is not None:
+        return attributes
+    return await _inflight.do(key, lambda: _fetch_difficulty_attributes(*key, priority))
+
+
+async def _fetch_difficulty_attributes(beatmap_id: int, mods: tuple[str, ...], mode: str, priority: int) -> dict:
+    difficulty, beatmap = await asyncio.gather(
+        osu_api.beatmap_attributes(
+            beatmap_id, mods="".join(mods) or None, ruleset=RULESETS[mode], priority=priority
+        ),
+        osu_api.beatmap(beatmap_id, priority=priority),
+    )
+    attributes = {
+        name: getattr(difficulty.attributes, name, None)
+        for name in ATTRIBUTE_NAMES
+        if getattr(difficulty.attributes, name, None) is not None
+    }
+    attributes.update({
+        "count_circles": beatmap.count_circles,
+        "count_sliders": beatmap.count_sliders,
+        "count_spinners": beatmap.count_spinners,
+    })
+    await difficulty_cache.aset((beatmap_id, mods, mode), attributes)
+
+    # The beatmap lookup comes with its metadata, keep it for score simulations
+    if await beatmap_cache.apeek(beatmap_id) is None:
+        beatmapset = await osu_api.run_sync(beatmap.beatmapset)
+        await remember_beatmaps([(beatmap_id, beatmapset.title, beatmapset.artist, beatmap.version)])
+
+    return attributes
+
+
+async def _prefetch(maps: list[tuple[int, list[str]]], mode: str):
+    for beatmap_id, mods in maps:
+        if await difficulty_cache.apeek((beatmap_id, _mods_key(mods), mode)) is not None:
+            continue
+        try:
+            async with _prefetch_semaphore:
+                await get_difficulty_attributes(beatmap_id, mods, mode, priority=osu_api.BACKGROUND)
+        except osu_api.OsuApiUnavailable:
+            # The osu! API is busy with interactive requests, which matter more
+            return
+        except Exception as e:
+            print(f"Difficulty prefetch of beatmap {beatmap_id} failed: {e}")
+
+
+def prefetch_difficulty_attributes(maps: list[tuple[int, list[str]]], mode: str = "osu"):
+    """
+    Fetch the difficulty attributes of (beatmap id, mods) pairs in the background, one at a
+    time and behind every interactive osu! API request
+    """
+    task = asyncio.create_task(_prefetch(maps, mode))
+    _prefetch_tasks.add(task)
+    task.add_done_callback(_prefetch_tasks.discard)
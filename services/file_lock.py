@@ -0,0 +1,40 @@
+import asyncio
+import os
+from typing import IO, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # Without file locks (Windows), every process gets the lock
+    fcntl = None
+
+
+def try_lock_file(path: str) -> Optional[IO]:
+    """
+    Open and exclusively lock `path`, or return None if another process holds it.
+    The lock lasts until the returned file is closed (or the process exits).
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    lock_file = open(path, "w")
+    if fcntl is None:
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+async def lock_file(path: str, poll_interval: float = 1) -> IO:
+    """
+    Wait until `path` is exclusively locked by this process. Polled rather than blocking a
+    thread, so that cancelling the wait (when the app stops) is immediate.
+    """
+    while True:
+        locked = try_lock_file(path)
+        if locked is not None:
+            return locked
+        await asyncio.sleep(poll_interval)
@@ -0,0 +1,183 @@
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterable
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from services.cache import CACHES
+
+# Minimal Prometheus-style metrics, rendered in the text exposition format on /metrics
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_metrics = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: dict[tuple, float] = {}
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(labels)} {value}"
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: dict[tuple, float] = {}
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self._values[_label_key(labels)] = value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # labels -> [count per bucket (+Inf last), sum]
+        self._values: dict[tuple, list] = {}
+        _metrics.append(self)
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket_labels = labels + (("le", bound),)
+                yield f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {total}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+http_requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being handled")
+http_request_duration = Histogram("http_request_duration_seconds", "Request latency by route")
+http_requests = Counter("http_requests_total", "Requests by route and status code")
+osu_api_request_duration = Histogram("osu_api_request_duration_seconds", "osu! API call latency by method")
+osu_api_requests = Counter("osu_api_requests_total", "osu! API calls by method and outcome")
+osu_api_queue_depth = Gauge("osu_api_queue_depth", "osu! API calls waiting for the rate limiter")
+osu_api_requests_rejected = Counter("osu_api_requests_rejected_total", "osu! API calls refused because the queue was full")
+calculator_request_duration = Histogram("calculator_request_duration_seconds", "Calculator API call latency by path")
+calculator_requests = Counter("calculator_requests_total", "Calculator API calls by path and status code")
+calculator_circuit_open = Gauge("calculator_circuit_open", "1 while the circuit breaker of a calculator path is open")
+
+
+class RequestMetricsMiddleware:
+    """
+    Record latency, status and in-flight count of every HTTP request. Pure ASGI, so that
+    response bodies go through untouched (a streamed response stays streamed).
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            # Label by route template, not by raw path, to keep the number of series bounded
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            http_request_duration.observe(time.perf_counter() - start, method=method, route=route_path)
+            http_requests.inc(method=method, route=route_path, status=status)
+
+
+def _render_caches(stats: dict[str, dict]) -> Iterable[str]:
+    for name, documentation, stat in (
+        ("cache_hits_total", "Cache hits by cache", "hits"),
+        ("cache_misses_total", "Cache misses by cache", "misses"),
+        ("cache_entries", "Entries currently held by cache", "size"),
+    ):
+        yield f"# HELP {name} {documentation}"
+        yield f"# TYPE {name} {'gauge' if stat == 'size' else 'counter'}"
+        for cache_name, cache_stats in stats.items():
+            yield f"{name}{_format_labels((('cache', cache_name),))} {cache_stats[stat]}"
+
+
+def _cache_stats() -> dict[str, dict]:
+    return {name: cache.stats() for name, cache in list(CACHES.items())}
+
+
+async def render() -> str:
+    # Rendered on the event loop, which is the only one updating the metrics
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    # Counting the entries of a SQLite cache queries the database, once per cache and off the loop
+    lines.extend(_render_caches(await asyncio.to_thread(_cache_stats)))
+    return "\n".join(lines) + "\n"
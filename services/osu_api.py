@@ -0,0 +1,189 @@
+import asyncio
+import functools
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from ossapi import Ossapi
+
+from services import metrics
+from services.rate_limit import BACKGROUND, INTERACTIVE, QueueFull, TokenBucketScheduler
+
+# Ossapi is a synchronous (requests based) client, so every call is pushed onto
+# a dedicated thread pool instead of running on the event loop. The pool size
+# is the maximum number of osu! API requests in flight at any given time.
+OSU_API_MAX_WORKERS = int(os.getenv("OSU_API_MAX_WORKERS", "8"))
+
+# Outbound rate limit, kept under the osu! API limit of 1200 requests per minute. Requests
+# beyond the burst wait their turn, interactive ones ahead of background work, and are
+# refused once OSU_API_MAX_QUEUE of them are already waiting.
+# The rate and burst are for the whole app: each of the WEB_CONCURRENCY workers (read by
+# uvicorn as its number of worker processes) gets an equal share.
+OSU_API_RATE_LIMIT = float(os.getenv("OSU_API_RATE_LIMIT", "1000"))
+OSU_API_BURST = int(os.getenv("OSU_API_BURST", "50"))
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+OSU_API_MAX_QUEUE = int(os.getenv("OSU_API_MAX_QUEUE", "200"))
+# Retries of a request answered with 429, waiting Retry-After or an exponential backoff
+OSU_API_MAX_RETRIES = int(os.getenv("OSU_API_MAX_RETRIES", "3"))
+OSU_API_RETRY_BACKOFF = float(os.getenv("OSU_API_RETRY_BACKOFF", "1"))
+
+# Alternative osu! server (e.g. the local stand-in from bench/fakes.py), instead of osu.ppy.sh
+OSU_API_URL = os.getenv("OSU_API_URL")
+# Where the OAuth token is saved (Ossapi's package directory by default). Workers sharing a
+# directory reuse the saved token instead of each requesting a new one when they boot.
+OSU_TOKEN_DIRECTORY = os.getenv("OSU_TOKEN_DIRECTORY")
+
+_executor = ThreadPoolExecutor(max_workers=OSU_API_MAX_WORKERS, thread_name_prefix="osu-api")
+_scheduler = TokenBucketScheduler(
+    OSU_API_RATE_LIMIT / 60 / WEB_CONCURRENCY, max(1, OSU_API_BURST // WEB_CONCURRENCY), OSU_API_MAX_QUEUE
+)
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: Optional[float] = None):
+        super().__init__("osu! API rate limit reached")
+        self.retry_after = retry_after
+
+
+class OsuApiUnavailable(Exception):
+    """
+    The osu! API cannot take the request right now (queue full or still rate limited),
+    answered with a 503
+    """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _check_rate_limit(response, *args, **kwargs):
+    # Ossapi would otherwise try to parse the 429 body as a regular response
+    if response.status_code == 429:
+        retry_after = response.headers.get("Retry-After")
+        raise RateLimited(float(retry_after) if retry_after and retry_after.isdigit() else None)
+
+
+class RateLimitedOssapi(Ossapi):
+    # Ossapi replaces its session when it re-authenticates, hook every new one
+    @property
+    def session(self):
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        if _check_rate_limit not in session.hooks["response"]:
+            session.hooks["response"].append(_check_rate_limit)
+        self._session = session
+
+
+def _client_class():
+    if not OSU_API_URL:
+        return RateLimitedOssapi
+    return type("LocalOssapi", (RateLimitedOssapi,), {
+        "TOKEN_URL": f"{OSU_API_URL}/oauth/token",
+        "BASE_URL": f"{OSU_API_URL}/api/v2",
+    })
+
+
+_api: Optional[Ossapi] = None
+_api_lock = threading.Lock()
+
+
+def get_api() -> Ossapi:
+    """
+    The shared client, authenticated on first use. Blocking, only call it from the thread pool.
+    """
+    global _api
+    if _api is None:
+        with _api_lock:
+            if _api is None:
+                _api = _client_class()(
+                    int(os.getenv("OSU_CLIENT_ID")),
+                    os.getenv("OSU_CLIENT_SECRET"),
+                    token_directory=OSU_TOKEN_DIRECTORY,
+                )
+    return _api
+
+
+async def startup():
+    """
+    Authenticate ahead of the first request, called from the FastAPI lifespan. On failure the
+    app still starts and the next osu! API call tries again.
+    """
+    try:
+        await run_sync(get_api)
+    except Exception as e:
+        print(f"osu! API authentication failed, retrying on first use: {e}")
+
+
+async def run_sync(fn, *args, **kwargs):
+    """
+    Run a blocking callable on the osu! API thread pool
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _invoke(method: str, *args, **kwargs):
+    return getattr(get_api(), method)(*args, **kwargs)
+
+
+async def _acquire(priority: int):
+    try:
+        await _scheduler.acquire(priority)
+    except QueueFull:
+        metrics.osu_api_requests_rejected.inc()
+        retry_after = 1 + len(_scheduler) / _scheduler.rate
+        raise OsuApiUnavailable("Too many osu! API requests are waiting, try again later", retry_after)
+    finally:
+        metrics.osu_api_queue_depth.set(len(_scheduler))
+
+
+async def _call(method: str, *args, priority: int = INTERACTIVE, **kwargs):
+    for attempt in range(OSU_API_MAX_RETRIES + 1):
+        await _acquire(priority)
+        outcome = "error"
+        try:
+            with metrics.osu_api_request_duration.time(method=method):
+                result = await run_sync(_invoke, method, *args, **kwargs)
+            outcome = "ok"
+            return result
+        except RateLimited as e:
+            outcome = "rate_limited"
+            delay = e.retry_after or OSU_API_RETRY_BACKOFF * 2 ** attempt
+            if attempt == OSU_API_MAX_RETRIES:
+                raise OsuApiUnavailable("osu! API rate limit reached, try again later", delay)
+            # Everyone holds off, with jitter so that retries do not all fire at once
+            _scheduler.pause(delay * random.uniform(1, 1.5))
+        finally:
+            metrics.osu_api_requests.inc(method=method, outcome=outcome)
+
+
+async def user(*args, **kwargs):
+    return await _call("user", *args, **kwargs)
+
+
+async def user_scores(*args, **kwargs):
+    return await _call("user_scores", *args, **kwargs)
+
+
+async def search(*args, **kwargs):
+    return await _call("search", *args, **kwargs)
+
+
+async def search_beatmapsets(*args, **kwargs):
+    return await _call("search_beatmapsets", *args, **kwargs)
+
+
+async def beatmap(*args, **kwargs):
+    return await _call("beatmap", *args, **kwargs)
+
+
+async def beatmap_attributes(*args, **kwargs):
+    return await _call("beatmap_attributes", *args, **kwargs)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,74 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+from services.top_plays import RATE
+
+# Upper bound on the doubling and bisection steps of required_play_pp
+MAX_SEARCH_STEPS = 200
+
+
+class PlayGainModel:
+    """
+    Prefix sums over the weighted pp of a profile's top plays, answering "what would a new play
+    worth x pp do to my profile" for many x at once, without touching the plays themselves.
+    A candidate is a play on a beatmap not yet in the top plays.
+    """
+
+    def __init__(self, top_plays, bonus_pp: float = 0):
+        pps = np.array([score.pp for score in top_plays.counted()], dtype=float)
+        self._keys = -pps  # ascending, for searchsorted
+        self._prefix = np.concatenate(([0.0], np.cumsum(pps * RATE ** np.arange(len(pps)))))
+        self.weighted_pp = self._prefix[-1]
+        self.bonus_pp = bonus_pp
+        # Like /update/new, a play not beating the 100th score does not enter the top plays
+        self.cutoff_pp: Optional[float] = top_plays.score_at(99).pp if len(top_plays) >= 100 else None
+
+    @property
+    def profile_pp(self) -> float:
+        return self.weighted_pp + self.bonus_pp
+
+    def profile_pp_with(self, candidates) -> np.ndarray:
+        """
+        Profile pp after adding a play worth each of the candidate pp values
+        """
+        candidates = np.asarray(candidates, dtype=float)
+        # The candidate lands at position k: the plays before it keep their weight,
+        # the ones after it move down one position
+        k = np.searchsorted(self._keys, -candidates, side="right")
+        prefix = self._prefix[k]
+        weighted_pp = prefix + candidates * RATE ** k + RATE * (self.weighted_pp - prefix)
+        if self.cutoff_pp is not None:
+            weighted_pp = np.where(candidates <= self.cutoff_pp, self.weighted_pp, weighted_pp)
+        return weighted_pp + self.bonus_pp
+
+    def required_play_pp(self, target_profile_pp: float, tolerance: float = 0.01) -> float:
+        """
+        Smallest pp a single new play needs for the profile to reach a target pp, by bisection.
+        Raises ValueError if the target is not finite or out of reach within MAX_SEARCH_STEPS.
+        """
+        if not math.isfinite(target_profile_pp):
+            raise ValueError("The target profile pp must be a finite number")
+        if target_profile_pp <= self.profile_pp:
+            return 0.0
+
+        low = self.cutoff_pp or 0.0
+        high = max(low, 1.0)
+        for _ in range(MAX_SEARCH_STEPS):
+            if self.profile_pp_with(high) >= target_profile_pp:
+                break
+            high *= 2
+        else:
+            raise ValueError(f"A profile of {target_profile_pp}pp cannot be reached with a single play")
+
+        for _ in range(MAX_SEARCH_STEPS):
+            middle = (low + high) / 2
+            # Past the tolerance, or no float left between the bounds at this magnitude
+            if high - low <= tolerance or middle in (low, high):
+                break
+            if self.profile_pp_with(middle) >= target_profile_pp:
+                high = middle
+            else:
+                low = middle
+        return high
@@ -0,0 +1,208 @@
+import numpy as np
+
+# Local, vectorized osu!standard performance formula (stable scoring), fed with the difficulty
+# attributes from services.difficulty. Every hit count argument can be an array, so a whole
+# grid of scores on one beatmap is evaluated in a single call. It mirrors the osu!standard
+# performance calculator closely but is an estimate: the calculator API stays the reference.
+
+PERFORMANCE_BASE_MULTIPLIER = 1.15
+
+# Attributes the formula cannot do without. services.difficulty drops the ones the osu! API
+# left empty, so they are checked up front rather than failing halfway through.
+REQUIRED_ATTRIBUTES = (
+    "count_circles", "count_sliders", "count_spinners", "max_combo",
+    "aim_difficulty", "speed_difficulty", "approach_rate", "overall_difficulty",
+)
+
+
+def _difficulty_to_performance(difficulty: float) -> float:
+    return (5 * max(1.0, difficulty / 0.0675) - 4) ** 3 / 100000
+
+
+def missing_attributes(attributes: dict) -> list[str]:
+    return [name for name in REQUIRED_ATTRIBUTES if attributes.get(name) is None]
+
+
+def osu_hit_results(total_hits: int, accuracy, nmiss):
+    """
+    Hit counts (n300, n100, n50) reaching an accuracy (0-1) with a number of misses.
+    100s are used first, 50s only once 100s alone cannot go low enough.
+    """
+    accuracy = np.asarray(accuracy, dtype=float)
+    nmiss = np.clip(np.asarray(nmiss, dtype=float), 0, total_hits)
+    remaining = total_hits - nmiss
+
+    # Points lost compared to an SS, where a miss loses 300, a 100 loses 200 and a 50 loses 250
+    lost = np.maximum((1 - accuracy) * total_hits * 300 - nmiss * 300, 0)
+    n100 = np.round(lost / 200)
+    over = n100 > remaining
+    n50 = np.where(over, np.clip(np.round((lost - 200 * remaining) / 50), 0, remaining), 0)
+    n100 = np.where(over, remaining - n50, n100)
+    n300 = remaining - n100 - n50
+    return n300, n100, n50
+
+
+def osu_performance(attributes: dict, mods: list[str], n300, n100, n50, nmiss, combo):
+    """
+    pp of osu!standard scores, broadcasting over the hit count and combo arrays.
+    Raises ValueError if a required difficulty attribute is missing.
+    """
+    missing = missing_attributes(attributes)
+    if missing:
+        raise ValueError(f"Missing difficulty attributes: {', '.join(missing)}")
+
+    mods = {mod.upper() for mod in mods}
+    n300, n100, n50, nmiss, combo = np.broadcast_arrays(*(
+        # Negative counts would read as better than a full combo SS
+        np.maximum(np.asarray(x, dtype=float), 0) for x in (n300, n100, n50, nmiss, combo)
+    ))
+
+    circles = attributes["count_circles"]
+    sliders = attributes["count_sliders"]
+    spinners = attributes["count_spinners"]
+    max_combo = attributes["max_combo"]
+    approach_rate = attributes["approach_rate"]
+    overall_difficulty = attributes["overall_difficulty"]
+
+    total_hits = n300 + n100 + n50 + nmiss
+    accuracy = np.where(total_hits > 0, (300 * n300 + 100 * n100 + 50 * n50) / (300 * np.maximum(total_hits, 1)), 0)
+
+    # Misses estimated from a combo lower than the full combo (slider breaks)
+    combo_based_miss_count = np.zeros_like(total_hits)
+    if sliders > 0:
+        full_combo_threshold = max_combo - 0.1 * sliders
+        combo_based_miss_count = np.where(
+            combo < full_combo_threshold, full_combo_threshold / np.maximum(combo, 1), 0
+        )
+    combo_based_miss_count = np.minimum(combo_based_miss_count, n100 + n50 + nmiss)
+    effective_miss_count = np.maximum(nmiss, combo_based_miss_count)
+
+    multiplier = np.full_like(total_hits, PERFORMANCE_BASE_MULTIPLIER)
+    if "NF" in mods:
+        multiplier *= np.maximum(0.9, 1 - 0.02 * effective_miss_count)
+    if "SO" in mods:
+        multiplier *= 1 - (spinners / np.maximum(total_hits, 1)) ** 0.85
+    if "RX" in mods:
+        # Relax makes 100s and 50s count as misses depending on the overall difficulty
+        ok_multiplier = 1 - (overall_difficulty / 13.33) ** 1.8 if overall_difficulty > 0 else 1
+        meh_multiplier = 1 - (overall_difficulty / 13.33) ** 5 if overall_difficulty > 0 else 1
+        effective_miss_count = np.minimum(
+            effective_miss_count + n100 * ok_multiplier + n50 * meh_multiplier, total_hits
+        )
+
+    miss_ratio = effective_miss_count / np.maximum(total_hits, 1)
+    length_bonus = 0.95 + 0.4 * np.minimum(1, total_hits / 2000) + np.where(
+        total_hits > 2000, np.log10(np.maximum(total_hits, 1) / 2000) * 0.5, 0
+    )
+    combo_scaling = np.minimum(combo ** 0.8 / max_combo ** 0.8, 1) if max_combo > 0 else 1
+    hidden = "HD" in mods or "TC" in mods
+
+    # Aim
+    aim = _difficulty_to_performance(attributes["aim_difficulty"]) * length_bonus
+    aim = np.where(
+        effective_miss_count > 0, aim * 0.97 * (1 - miss_ratio ** 0.775) ** effective_miss_count, aim
+    )
+    aim *= combo_scaling
+    approach_rate_factor = 0.0
+    if "RX" not in mods:
+        if approach_rate > 10.33:
+            approach_rate_factor = 0.3 * (approach_rate - 10.33)
+        elif approach_rate < 8:
+            approach_rate_factor = 0.05 * (8 - approach_rate)
+    aim *= 1 + approach_rate_factor * length_bonus
+    if hidden:
+        aim *= 1 + 0.04 * (12 - approach_rate)
+    if sliders > 0:
+        # Slider ends dropped are estimated from the combo, and nerf the aim of slider-heavy maps
+        slider_factor = attributes.get("slider_factor", 1)
+        difficult_sliders = sliders * 0.15
+        slider_ends_dropped = np.clip(
+            np.minimum(n100 + n50 + nmiss, max_combo - combo), 0, difficult_sliders
+        )
+        aim *= (1 - slider_factor) * (1 - slider_ends_dropped / difficult_sliders) ** 3 + slider_factor
+    aim *= accuracy
+    aim *= 0.98 + overall_difficulty ** 2 / 2500
+
+    # Speed
+    if "RX" in mods:
+        speed = np.zeros_like(total_hits)
+    else:
+        speed = _difficulty_to_performance(attributes["speed_difficulty"]) * length_bonus
+        speed = np.where(
+            effective_miss_count > 0,
+            speed * 0.97 * (1 - miss_ratio ** 0.775) ** (effective_miss_count ** 0.875),
+            speed,
+        )
+        speed *= combo_scaling
+        if approach_rate > 10.33:
+            speed *= 1 + 0.3 * (approach_rate - 10.33) * length_bonus
+        if hidden:
+            speed *= 1 + 0.04 * (12 - approach_rate)
+
+        # Accuracy on the notes that matter for speed
+        speed_note_count = attributes.get("speed_note_count", 0)
+        relevant_total_diff = np.maximum(0, total_hits - speed_note_count)
+        relevant_n300 = np.maximum(0, n300 - relevant_total_diff)
+        relevant_n100 = np.maximum(0, n100 - np.maximum(0, relevant_total_diff - n300))
+        relevant_n50 = np.maximum(0, n50 - np.maximum(0, relevant_total_diff - n300 - n100))
+        relevant_accuracy = (
+            (relevant_n300 * 6 + relevant_n100 * 2 + relevant_n50) / (speed_note_count * 6)
+            if speed_note_count > 0 else np.zeros_like(total_hits)
+        )
+        speed *= (0.95 + overall_difficulty ** 2 / 750) * ((accuracy + relevant_accuracy) / 2) ** (
+            (14.5 - overall_difficulty) / 2
+        )
+        speed *= 0.99 ** np.where(n50 < total_hits / 500, 0, n50 - total_hits / 500)
+
+    # Accuracy, only judged on circles
+    if circles > 0:
+        better_accuracy = np.maximum(0, ((n300 - (total_hits - circles)) * 6 + n100 * 2 + n50) / (circles * 6))
+    else:
+        better_accuracy = np.zeros_like(total_hits)
+    accuracy_value = 1.52163 ** overall_difficulty * better_accuracy ** 24 * 2.83
+    accuracy_value *= min(1.15, (circles / 1000) ** 0.3)
+    if hidden:
+        accuracy_value *= 1.08
+    if "FL" in mods:
+        accuracy_value *= 1.02
+
+    # Flashlight
+    if "FL" in mods:
+        flashlight = attributes.get("flashlight_difficulty", 0) ** 2 * 25
+        flashlight = np.where(
+            effective_miss_count > 0,
+            flashlight * 0.97 * (1 - miss_ratio ** 0.775) ** (effective_miss_count ** 0.875),
+            flashlight,
+        )
+        flashlight *= combo_scaling
+        flashlight *= 0.7 + 0.1 * np.minimum(1, total_hits / 200) + np.where(
+            total_hits > 200, 0.2 * np.minimum(1, (total_hits - 200) / 200), 0
+        )
+        flashlight *= 0.5 + accuracy / 2
+        flashlight *= 0.98 + overall_difficulty ** 2 / 2500
+    else:
+        flashlight = np.zeros_like(total_hits)
+
+    total = (aim ** 1.1 + speed ** 1.1 + accuracy_value ** 1.1 + flashlight ** 1.1) ** (1 / 1.1)
+    return total * multiplier
+
+
+def osu_accuracy_sweep(attributes: dict, mods: list[str], accuracies, misses, combo=None):
+    """
+    pp over a grid of accuracies (percent) and miss counts, shaped (len(misses), len(accuracies)).
+    Without a combo, each miss is assumed to cost one combo.
+    Raises ValueError if a required difficulty attribute is missing.
+    """
+    missing = missing_attributes(attributes)
+    if missing:
+        raise ValueError(f"Missing difficulty attributes: {', '.join(missing)}")
+
+    total_hits = attributes["count_circles"] + attributes["count_sliders"] + attributes["count_spinners"]
+    accuracy = np.asarray(accuracies, dtype=float)[np.newaxis, :] / 100
+    nmiss = np.asarray(misses, dtype=float)[:, np.newaxis]
+
+    n300, n100, n50 = osu_hit_results(total_hits, accuracy, nmiss)
+    nmiss = np.broadcast_to(nmiss, n300.shape)
+    if combo is None:
+        combo = np.maximum(attributes["max_combo"] - nmiss, 0)
+    return osu_performance(attributes, mods, n300, n100, n50, nmiss, combo)
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import math
+import os
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Optional
+
+from services import calculator
+from services.file_lock import lock_file
+
+# Local copy of the pp -> global rank curve of every mode, so converting between
+# the two is a bisect plus an interpolation instead of a calculator round-trip.
+# The snapshot is shared by every worker using the same path: one of them samples the
+# calculator when it is missing or older than RANK_INDEX_REFRESH_INTERVAL, the others load it.
+# Until the very first snapshot is written, conversions still go to the calculator.
+RANK_SNAPSHOT_PATH = os.getenv("RANK_SNAPSHOT_PATH", "data/rank_snapshot.json")
+RANK_INDEX_REFRESH = os.getenv("RANK_INDEX_REFRESH", "true").lower() in ("1", "true", "yes")
+RANK_INDEX_REFRESH_INTERVAL = float(os.getenv("RANK_INDEX_REFRESH_INTERVAL", "21600"))
+RANK_INDEX_REFRESH_CONCURRENCY = int(os.getenv("RANK_INDEX_REFRESH_CONCURRENCY", "4"))
+
+MODES = (0, 1, 2, 3)
+
+# pp values sampled from the calculator when refreshing, denser where the rank moves the most
+SAMPLE_PP = [*range(0, 15000, 50), *range(15000, 30001, 250)]
+
+
+class RankTable:
+    """
+    Sorted pp/rank points of a single mode, interpolated in log-rank space
+    """
+
+    def __init__(self, points: list[tuple[float, int]]):
+        # Sort by pp and keep the curve strictly monotonic: as pp goes up the rank must go down
+        self.pps: list[float] = []
+        self.ranks: list[int] = []
+        for pp, rank in sorted(points):
+            if rank <= 0 or (self.ranks and rank >= self.ranks[-1]):
+                continue
+            self.pps.append(pp)
+            self.ranks.append(rank)
+
+        # Same points by ascending rank, for the rank -> pp direction
+        self._rank_keys = self.ranks[::-1]
+        self._rank_pps = self.pps[::-1]
+
+    def __len__(self):
+        return len(self.pps)
+
+    def points(self) -> list[tuple[float, int]]:
+        return list(zip(self.pps, self.ranks))
+
+    def rank_for_pp(self, pp: float) -> int:
+        i = bisect_left(self.pps, pp)
+        if i == 0:
+            return self.ranks[0]
+        if i == len(self.pps):
+            return self.ranks[-1]
+
+        p0, p1 = self.pps[i - 1], self.pps[i]
+        r0, r1 = self.ranks[i - 1], self.ranks[i]
+        t = (pp - p0) / (p1 - p0)
+        return max(1, round(math.exp(math.log(r0) + t * (math.log(r1) - math.log(r0)))))
+
+    def pp_for_rank(self, rank: int) -> float:
+        rank = max(rank, 1)
+        i = bisect_left(self._rank_keys, rank)
+        if i == 0:
+            return self._rank_pps[0]
+        if i == len(self._rank_keys):
+            return self._rank_pps[-1]
+
+        r0, r1 = self._rank_keys[i - 1], self._rank_keys[i]
+        p0, p1 = self._rank_pps[i - 1], self._rank_pps[i]
+        t = (math.log(rank) - math.log(r0)) / (math.log(r1) - math.log(r0))
+        return p0 + t * (p1 - p0)
+
+
+_tables: dict[int, RankTable] = {}
+_refresh_task: Optional[asyncio.Task] = None
+
+
+def pp_to_rank(pp: float, mode: int = 0) -> Optional[int]:
+    """
+    Global rank for a pp value, or None if no table is loaded for this mode
+    """
+    table = _tables.get(mode)
+    return table.rank_for_pp(pp) if table else None
+
+
+def rank_to_pp(rank: int, mode: int = 0) -> Optional[float]:
+    """
+    pp needed for a global rank, or None if no table is loaded for this mode
+    """
+    table = _tables.get(mode)
+    return table.pp_for_rank(rank) if table else None
+
+
+def load_snapshot(path: str = RANK_SNAPSHOT_PATH):
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        print(f"Could not load rank snapshot '{path}': {e}")
+        return
+
+    for mode, points in snapshot.get("modes", {}).items():
+        table = RankTable([(pp, rank) for pp, rank in points])
+        if len(table) >= 2:
+            _tables[int(mode)] = table
+
+
+def save_snapshot(path: str = RANK_SNAPSHOT_PATH):
+    snapshot = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "modes": {str(mode): table.points() for mode, table in _tables.items()},
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+async def _sample(pp: float, mode: int, semaphore: asyncio.Semaphore) -> Optional[tuple[float, int]]:
+    async with semaphore:
+        try:
+            response = await calculator.get("/convert/to-rank", params={"pp": pp, "mode": mode})
+            if response.status_code != 200:
+                return None
+            return pp, int(response.json()["rank"])
+        except Exception:
+            # A failed or malformed sample is dropped, the others still make the table
+            return None
+
+
+async def refresh_mode(mode: int):
+    semaphore = asyncio.Semaphore(RANK_INDEX_REFRESH_CONCURRENCY)
+    samples = await asyncio.gather(*(_sample(pp, mode, semaphore) for pp in SAMPLE_PP))
+    table = RankTable([sample for sample in samples if sample is not None])
+    if len(table) >= 2:
+        _tables[mode] = table
+
+
+async def refresh():
+    """
+    Rebuild every mode's table from the calculator API and persist it as the new snapshot
+    """
+    for mode in MODES:
+        await refresh_mode(mode)
+    if _tables:
+        try:
+            save_snapshot()
+        except OSError as e:
+            print(f"Could not save rank snapshot '{RANK_SNAPSHOT_PATH}': {e}")
+
+
+def _snapshot_age(path: str = RANK_SNAPSHOT_PATH) -> Optional[float]:
+    try:
+        return time.time() - os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+async def refresh_shared():
+    """
+    Load the snapshot if it is complete and recent enough, otherwise refresh it. Workers take
+    turns through a file lock, so the ones waiting on a refresh load its result instead of
+    sampling the calculator again
+    """
+    snapshot_lock = await lock_file(f"{RANK_SNAPSHOT_PATH}.lock")
+    try:
+        age = _snapshot_age()
+        if age is not None and age < RANK_INDEX_REFRESH_INTERVAL:
+            load_snapshot()
+            if all(mode in _tables for mode in MODES):
+                return
+        await refresh()
+    finally:
+        # Closing the file releases the lock
+        snapshot_lock.close()
+
+
+async def _refresh_loop():
+    while True:
+        try:
+            await refresh_shared()
+        except Exception as e:
+            print(f"Rank index refresh failed: {e}")
+        # Wake up when the snapshot expires, whichever worker wrote it
+        age = _snapshot_age()
+        delay = RANK_INDEX_REFRESH_INTERVAL if age is None else RANK_INDEX_REFRESH_INTERVAL - age
+        await asyncio.sleep(max(delay, 60))
+
+
+def start():
+    global _refresh_task
+    load_snapshot()
+    if RANK_INDEX_REFRESH and _refresh_task is None:
+        _refresh_task = asyncio.create_task(_refresh_loop())
+
+
+async def stop():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None
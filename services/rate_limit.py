@@ -0,0 +1,86 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Optional
+
+# Request priorities, lower goes first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class QueueFull(Exception):
+    pass
+
+
+class TokenBucketScheduler:
+    """
+    Token bucket admitting at most `rate` requests per second (bursts of up to `burst`).
+    Waiting requests are let through by priority, then in arrival order. Once `max_queue`
+    requests are waiting, new ones are refused with QueueFull instead of piling up.
+    """
+
+    def __init__(self, rate: float, burst: int, max_queue: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # (priority, sequence, future)
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._waiters)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _try_take(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        if now >= self._paused_until and self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self, priority: int = INTERACTIVE):
+        if not self._waiters and self._try_take():
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise QueueFull(f"{len(self._waiters)} requests are already waiting")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The token was handed over right as the waiter went away, give it back
+                self._tokens = min(self.burst, self._tokens + 1)
+            raise
+
+    def pause(self, seconds: float):
+        """
+        Stop admitting requests for a while, e.g. after the server answered 429
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def _dispatch(self):
+        while self._waiters:
+            if self._waiters[0][2].done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if self._try_take():
+                heapq.heappop(self._waiters)[2].set_result(None)
+                continue
+            now = time.monotonic()
+            wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            await asyncio.sleep(max(wait, 0.001))
@@ -0,0 +1,58 @@
+import hashlib
+from typing import Any, Optional
+
+import orjson
+from pydantic import BaseModel
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dump_json(content: Any) -> bytes:
+    return orjson.dumps(
+        content,
+        default=_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+    )
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response serialized by orjson, pydantic models included.
+
+    Returned directly by the endpoints with large payloads (profiles and top plays), which
+    skips FastAPI's jsonable_encoder pass over the content before it is serialized.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, the W/ prefix is ignored on both sides
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def etag_response(request: Request, content: Any, max_age: int) -> Response:
+    """
+    FastJSONResponse with an ETag hashed from its body and a public Cache-Control max-age.
+    Answers 304 Not Modified, without a body, when the client already holds that version.
+    The ETag is weak since the body may be sent gzip or brotli encoded.
+    """
+    response = FastJSONResponse(content)
+    etag = f'W/"{hashlib.blake2b(response.body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return response
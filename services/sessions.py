@@ -0,0 +1,65 @@
+import asyncio
+import os
+import secrets
+from typing import Optional
+from weakref import WeakValueDictionary
+
+from services.cache import create_cache
+from services.top_plays import TopPlays
+
+# Theorizer sessions are dropped once idle for SESSION_IDLE_TTL seconds, or when
+# SESSION_MAX_COUNT newer sessions push them out
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "1000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+
+
+class TheorizerSession:
+    """
+    Server-side profile and top plays of one theorizer tab
+    """
+
+    def __init__(self, profile, scores, mode: int = 0):
+        self.profile = profile
+        self.top_plays = TopPlays(scores)
+        self.mode = mode
+
+
+# Kept on the CACHE_BACKEND like the other caches, so any worker can serve a session
+sessions = create_cache(maxsize=SESSION_MAX_COUNT, ttl=SESSION_IDLE_TTL, name="sessions")
+# Edits of one session are applied one at a time (within a process, the frontend sends the
+# edits of a tab one after the other)
+_locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+
+
+async def create_session(profile, scores, mode: int = 0) -> str:
+    token = secrets.token_urlsafe(16)
+    await sessions.aset(token, TheorizerSession(profile, scores, mode))
+    return token
+
+
+async def load_session(token: str) -> Optional[TheorizerSession]:
+    return await sessions.aget(token)
+
+
+async def save_session(token: str, session: TheorizerSession):
+    # Every save also pushes the idle deadline back
+    await sessions.aset(token, session)
+
+
+async def get_session(token: str) -> Optional[TheorizerSession]:
+    session = await load_session(token)
+    if session is not None:
+        # Sliding expiration: every access pushes the idle deadline back
+        await save_session(token, session)
+    return session
+
+
+def session_lock(token: str) -> asyncio.Lock:
+    lock = _locks.get(token)
+    if lock is None:
+        lock = _locks[token] = asyncio.Lock()
+    return lock
+
+
+async def close_session(token: str):
+    await sessions.adelete(token)
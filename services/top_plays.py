@@ -0,0 +1,187 @@
+import math
+from bisect import bisect_left, bisect_right
+from typing import Iterable
+
+# Weighting rate of the osu! pp system: the n-th best play counts for 0.95^n of its pp
+RATE = 0.95
+
+
+class TopPlays:
+    """
+    A profile's top plays, ordered by pp, with their weighted pp and accuracy sums kept up to date.
+
+    Only the best score of each beatmap is weighted ("counted"), other scores on the same beatmap are
+    kept with a weight of 0 ("shadowed"), like the osu! profile does. Adding or removing a score costs
+    a bisect plus re-weighting the scores that moved down or up a position.
+
+    Scores are the UserScore models sent by the frontend; their `weight` and `actual_pp` fields are
+    updated in place.
+    """
+
+    def __init__(self, scores: Iterable = ()):
+        self._counted = []  # pp descending, one score per beatmap
+        self._keys: list[float] = []  # -pp of each counted score, ascending for bisect
+        self._shadowed = []  # pp descending
+        self._shadowed_keys: list[float] = []
+        self._by_beatmap = {}  # beatmap_url -> counted score
+        self._by_id = {}  # score id -> score
+        self.weighted_pp = 0.0
+        self.weighted_acc = 0.0
+        # Scores whose weight changed and ids of scores removed since the last pop_changes()
+        self._changed = {}
+        self._removed: set[int] = set()
+
+        for score in sorted(scores, key=lambda x: x.pp, reverse=True):
+            self._by_id[score.id] = score
+            if score.beatmap_url in self._by_beatmap:
+                self._shadow(score)
+            else:
+                self._by_beatmap[score.beatmap_url] = score
+                self._counted.append(score)
+                self._keys.append(-score.pp)
+        self._reweight(0)
+        self.pop_changes()
+
+    def __len__(self) -> int:
+        return len(self._counted) + len(self._shadowed)
+
+    @property
+    def accuracy(self) -> float:
+        """
+        Profile accuracy, normalized like the osu! codebase does
+        """
+        n = min(len(self), 100)
+        if n == 0:
+            return 0
+        acc = self.weighted_acc * 100 / (20 * (1 - math.pow(RATE, n)))
+        # Handle floating point precision edge cases
+        return max(0, min(100, acc))
+
+    def scores(self) -> list:
+        """
+        All scores by weight (descending), the order the profile displays them in
+        """
+        return self._counted + self._shadowed
+
+    def counted(self) -> list:
+        """
+        The weighted scores (best per beatmap), by pp descending
+        """
+        return list(self._counted)
+
+    def score_at(self, index: int):
+        if index < len(self._counted):
+            return self._counted[index]
+        return self._shadowed[index - len(self._counted)]
+
+    def get_by_beatmap(self, beatmap_url: str):
+        """
+        The counted (best) score on a beatmap, if any
+        """
+        return self._by_beatmap.get(beatmap_url)
+
+    def get_by_id(self, score_id: int):
+        return self._by_id.get(score_id)
+
+    def pop_changes(self) -> tuple[list, list[int]]:
+        """
+        Scores added or re-weighted and ids of scores removed since the last call
+        """
+        changed, removed = list(self._changed.values()), sorted(self._removed)
+        self._changed = {}
+        self._removed = set()
+        return changed, removed
+
+    def add(self, score):
+        """
+        Add a score, replacing the counted score of its beatmap if it is worth more pp
+        """
+        self._by_id[score.id] = score
+        self._removed.discard(score.id)
+        current = self._by_beatmap.get(score.beatmap_url)
+        if current is not None:
+            if current.pp >= score.pp:
+                self._shadow(score)
+                return
+            self._uncount(current)
+            self._shadow(current)
+        self._count(score)
+
+    def remove(self, score):
+        """
+        Remove a score, promoting the next best score of its beatmap if it was the counted one
+        """
+        if self._by_id.get(score.id) is score:
+            del self._by_id[score.id]
+        self._changed.pop(score.id, None)
+        self._removed.add(score.id)
+
+        if self._by_beatmap.get(score.beatmap_url) is not score:
+            self._unshadow(score)
+            return
+
+        self._uncount(score)
+        replacement = next((s for s in self._shadowed if s.beatmap_url == score.beatmap_url), None)
+        if replacement is not None:
+            self._unshadow(replacement)
+            self._count(replacement)
+
+    def _count(self, score):
+        index = bisect_right(self._keys, -score.pp)
+        old_pp, old_acc = self._suffix_sums(index)
+        self._counted.insert(index, score)
+        self._keys.insert(index, -score.pp)
+        self._by_beatmap[score.beatmap_url] = score
+        self._reweight(index, old_pp, old_acc)
+
+    def _uncount(self, score):
+        index = bisect_left(self._keys, -score.pp)
+        while self._counted[index] is not score:
+            index += 1
+        old_pp, old_acc = self._suffix_sums(index)
+        del self._counted[index]
+        del self._keys[index]
+        del self._by_beatmap[score.beatmap_url]
+        self._reweight(index, old_pp, old_acc)
+
+    def _shadow(self, score):
+        index = bisect_right(self._shadowed_keys, -score.pp)
+        self._shadowed.insert(index, score)
+        self._shadowed_keys.insert(index, -score.pp)
+        score.weight = 0
+        score.actual_pp = 0
+        self._changed[score.id] = score
+
+    def _unshadow(self, score):
+        index = bisect_left(self._shadowed_keys, -score.pp)
+        while index < len(self._shadowed) and self._shadowed[index] is not score:
+            index += 1
+        if index < len(self._shadowed):
+            del self._shadowed[index]
+            del self._shadowed_keys[index]
+
+    def _suffix_sums(self, start: int) -> tuple[float, float]:
+        pp = acc = 0.0
+        factor = RATE ** start
+        for score in self._counted[start:]:
+            pp += score.pp * factor
+            acc += score.accuracy / 100 * factor
+            factor *= RATE
+        return pp, acc
+
+    def _reweight(self, start: int, old_pp: float = 0.0, old_acc: float = 0.0):
+        """
+        Recompute the weights of the counted scores from `start` on, swapping their old
+        contribution to the sums for the new one
+        """
+        pp = acc = 0.0
+        factor = RATE ** start
+        for score in self._counted[start:]:
+            score.weight = factor * 100
+            score.actual_pp = score.pp * factor
+            self._changed[score.id] = score
+            pp += score.actual_pp
+            acc += score.accuracy / 100 * factor
+            factor *= RATE
+        self.weighted_pp += pp - old_pp
+        self.weighted_acc += acc - old_acc
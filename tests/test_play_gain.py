@@ -0,0 +1,63 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+from pydantic import ValidationError
+
+from routers.user_update_router import PlayQueryParams
+from services.play_gain import PlayGainModel
+from services.top_plays import TopPlays
+
+
+def make_model(count: int = 100) -> PlayGainModel:
+    scores = [
+        SimpleNamespace(id=i, beatmap_url=f"https://osu.ppy.sh/beatmaps/{i}", pp=500 - i, accuracy=98.0,
+                        weight=0, actual_pp=0)
+        for i in range(count)
+    ]
+    return PlayGainModel(TopPlays(scores), bonus_pp=416)
+
+
+def test_required_play_pp_reaches_target():
+    model = make_model()
+    target = model.profile_pp + 100
+    required = model.required_play_pp(target)
+    assert model.profile_pp_with(required) >= target
+    assert model.profile_pp_with(required - 0.02) < target
+
+
+def test_required_play_pp_below_current_profile():
+    model = make_model()
+    assert model.required_play_pp(model.profile_pp - 1) == 0.0
+
+
+def test_required_play_pp_huge_target_terminates():
+    # Float spacing is above the tolerance at this magnitude
+    model = make_model()
+    required = model.required_play_pp(1e15)
+    assert math.isfinite(required)
+    assert model.profile_pp_with(required) >= 1e15
+
+
+def test_required_play_pp_unreachable_target_raises():
+    with pytest.raises(ValueError):
+        make_model().required_play_pp(1e300)
+
+
+@pytest.mark.parametrize("target", [math.inf, -math.inf, math.nan])
+def test_required_play_pp_rejects_non_finite_target(target):
+    with pytest.raises(ValueError):
+        make_model().required_play_pp(target)
+
+
+@pytest.mark.parametrize("field, value", [
+    ("target_pp", 1e15),
+    ("target_pp", math.inf),
+    ("target_pp", math.nan),
+    ("target_pp", -1),
+    ("candidates", [math.inf]),
+    ("target_rank", 0),
+])
+def test_play_query_rejects_out_of_range_values(field, value):
+    with pytest.raises(ValidationError):
+        PlayQueryParams(scores=[], **{field: value})
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from pydantic import ValidationError
+
+from routers.score_simulator_router import AccuracySweepParams
+from services import pp_formula
+
+ATTRIBUTES = {
+    "count_circles": 600,
+    "count_sliders": 300,
+    "count_spinners": 2,
+    "max_combo": 1300,
+    "star_rating": 6.5,
+    "aim_difficulty": 3.2,
+    "speed_difficulty": 3.0,
+    "speed_note_count": 400,
+    "slider_factor": 0.98,
+    "approach_rate": 9.5,
+    "overall_difficulty": 9.0,
+}
+
+
+def test_sweep_decreases_with_misses():
+    pp = pp_formula.osu_accuracy_sweep(ATTRIBUTES, [], [98, 99, 100], [0, 1, 5])
+    assert pp.shape == (3, 3)
+    assert np.all(np.diff(pp, axis=0) < 0)
+    assert np.all(np.diff(pp, axis=1) > 0)
+
+
+def test_negative_counts_do_not_exceed_full_combo():
+    full_combo = pp_formula.osu_accuracy_sweep(ATTRIBUTES, [], [100], [0])
+    negative = pp_formula.osu_accuracy_sweep(ATTRIBUTES, [], [100], [-5], combo=-1)
+    assert negative[0, 0] <= full_combo[0, 0]
+
+
+@pytest.mark.parametrize("name", ["approach_rate", "overall_difficulty", "count_circles"])
+def test_missing_attributes_raise(name):
+    attributes = {key: value for key, value in ATTRIBUTES.items() if key != name}
+    assert pp_formula.missing_attributes(attributes) == [name]
+    with pytest.raises(ValueError):
+        pp_formula.osu_accuracy_sweep(attributes, [], [100], [0])
+    with pytest.raises(ValueError):
+        pp_formula.osu_performance(attributes, [], 900, 0, 0, 0, 1300)
+
+
+@pytest.mark.parametrize("params", [
+    {"misses": [-1]},
+    {"combo": -1},
+    {"accuracies": [101]},
+    {"accuracies": [-1]},
+])
+def test_sweep_params_rejected(params):
+    with pytest.raises(ValidationError):
+        AccuracySweepParams(beatmapId=1, **params)